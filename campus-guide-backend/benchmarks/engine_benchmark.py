@@ -0,0 +1,92 @@
+# benchmarks/engine_benchmark.py
+"""
+Micro-benchmark of the per-request work done before a Gemini call is sent.
+
+"before" repeats what every answer used to do: construct a GenerativeModel and build the whole
+prompt, instructions included, from an f-string. "after" is ChatEngine.prepare, which reuses
+the long-lived model and fills in only the per-request template. Both build the same retrieval
+context; nothing is sent over the network.
+
+Run from campus-guide-backend:
+    python -m benchmarks.engine_benchmark --iterations 5000
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import google.generativeai as genai
+
+import chat_engine
+import database
+import retrieval
+from benchmarks import synthetic_campus
+
+QUERIES = ["what should I do this weekend?", "any clubs for music?", "tell me about the sports facilities"]
+HISTORY = [{"role": "user", "content": "hi"}, {"role": "assistant", "content": "Hello! How can I help?"}]
+
+def legacy_prepare(user_query, history, language_name, campus_data):
+    model = genai.GenerativeModel("gemini-2.5-flash")
+    college_info = campus_data.get("college_info") or {}
+    formatted_history = "\n".join([f"{msg['role'].capitalize()}: {msg['content']}" for msg in history])
+    previous_user_turns = [msg['content'] for msg in history if msg['role'] == 'user'][-1:]
+    campus_context = retrieval.build_context(" ".join(previous_user_turns + [user_query]), campus_data)
+    prompt = f"""
+    You are CampusGuide AI, an intelligent assistant for {college_info.get('name', 'the college')}.
+    Your primary goal is to provide concise, accurate, and friendly information to students and visitors.
+    You MUST respond in the following language: {language_name}.
+
+    **IMPORTANT ESCALATION RULE**:
+    If you absolutely cannot answer the user's question with the provided database information,
+    or if the user seems frustrated, your ONLY response MUST be this exact English phrase:
+    `{chat_engine.ESCALATION_RESPONSE}`
+    Do not translate this specific phrase. Do not add any other text.
+
+    Current User Query: "{user_query}"
+
+    Use the following database information to answer the query if relevant:
+    {campus_context}
+
+    Conversation History (for context):
+    {formatted_history}
+
+    Your Answer (in {language_name}, unless the escalation rule applies):
+    """
+    return model, prompt
+
+def measure(prepare, campus_data, iterations: int, repeats: int = 5):
+    """Best-of-repeats microseconds per call, and the average prompt length."""
+    best = float("inf")
+    for _ in range(repeats):
+        prompt_chars = 0
+        started = time.perf_counter()
+        for i in range(iterations):
+            _, prompt = prepare(QUERIES[i % len(QUERIES)], HISTORY, "English", campus_data)
+            prompt_chars += len(prompt)
+        best = min(best, time.perf_counter() - started)
+    return best / iterations * 1e6, prompt_chars / iterations
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=5000)
+    parser.add_argument("--locations", type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_NAME = os.path.join(tmp, "campus.db")
+        synthetic_campus.build(database.DB_NAME, locations=args.locations)
+        campus_data, _ = database.get_all_data_for_prompt()
+        engine = chat_engine.ChatEngine(context_cache=False)
+        retrieval.warm_up(campus_data)
+
+        before_us, before_chars = measure(legacy_prepare, campus_data, args.iterations)
+        after_us, after_chars = measure(engine.prepare, campus_data, args.iterations)
+        database.close_connections()
+
+    print(f"before: {before_us:8.1f} us/request, {before_chars:6.0f} prompt chars")
+    print(f"after:  {after_us:8.1f} us/request, {after_chars:6.0f} prompt chars "
+          f"plus a {len(chat_engine.SYSTEM_INSTRUCTION)}-char system instruction (cached with GEMINI_CONTEXT_CACHE=1)")
+    print(f"saved:  {before_us - after_us:8.1f} us/request ({(1 - after_us / before_us) * 100:.0f}%)")
+
+if __name__ == "__main__":
+    main()
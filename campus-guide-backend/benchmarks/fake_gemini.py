@@ -0,0 +1,67 @@
+# benchmarks/fake_gemini.py
+"""
+In-process stand-in for google.generativeai's GenerativeModel, so benchmarks measure the
+service rather than the network. Replies take `latency` seconds plus one token per
+1/`tokens_per_second` seconds (about 4 characters per token), streamed or not.
+"""
+import asyncio
+from typing import List
+
+import google.generativeai as genai
+
+REPLY_WORDS = "the campus guide suggests checking the notice board near the main library for details".split()
+
+class FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+class FakeStream:
+    def __init__(self, chunks: List[str], latency: float, seconds_per_chunk: float):
+        self._chunks = chunks
+        self._latency = latency
+        self._seconds_per_chunk = seconds_per_chunk
+
+    async def __aiter__(self):
+        await asyncio.sleep(self._latency)
+        for chunk in self._chunks:
+            await asyncio.sleep(self._seconds_per_chunk)
+            yield FakeResponse(chunk)
+
+class FakeGenerativeModel:
+    latency = 0.3
+    tokens_per_second = 200.0
+    reply_tokens = 60
+    calls = 0
+
+    def __init__(self, model_name: str = "fake", system_instruction=None, **kwargs):
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+
+    @classmethod
+    def from_cached_content(cls, cached_content, **kwargs):
+        return cls(getattr(cached_content, "model", "fake"))
+
+    def _reply(self, prompt: str) -> str:
+        # Varies with the prompt, but never echoes the escalation phrase the prompt itself contains
+        words = (REPLY_WORDS * (self.reply_tokens // len(REPLY_WORDS) + 1))[hash(prompt) % len(REPLY_WORDS):]
+        return " ".join(words[:self.reply_tokens]) + "."
+
+    async def generate_content_async(self, prompt, stream: bool = False, **kwargs):
+        type(self).calls += 1
+        text = self._reply(str(prompt))
+        tokens = max(len(text) // 4, 1)
+        if stream:
+            chunks = [text[i:i + 16] for i in range(0, len(text), 16)]
+            return FakeStream(chunks, self.latency, 4 / self.tokens_per_second)
+        await asyncio.sleep(self.latency + tokens / self.tokens_per_second)
+        return FakeResponse(text)
+
+    def generate_content(self, prompt, **kwargs):
+        type(self).calls += 1
+        return FakeResponse(self._reply(str(prompt)))
+
+def install(latency: float = 0.3, tokens_per_second: float = 200.0):
+    """Replaces genai.GenerativeModel with the fake for the rest of the process."""
+    FakeGenerativeModel.latency = latency
+    FakeGenerativeModel.tokens_per_second = tokens_per_second
+    genai.GenerativeModel = FakeGenerativeModel
@@ -0,0 +1,246 @@
+# benchmarks/livechat_redis_check.py
+"""
+Cross-worker check for the Redis live-chat backend.
+
+Runs two ConnectionManagers, standing in for two uvicorn workers, against one Redis, with users
+and agents on different workers, and walks through pairing, auto-assignment within agent
+capacity, waiting users leaving, two agents accepting the same user at once, and agents leaving.
+Uses an in-memory fakeredis server (lupa runs the Lua scripts) unless --redis-url points at a
+real one; each scenario gets its own key prefix, deleted afterwards. Exits with status 1 if any
+scenario fails.
+
+Run from campus-guide-backend, after pip install -r requirements-dev.txt:
+    python -m benchmarks.livechat_redis_check
+    python -m benchmarks.livechat_redis_check --redis-url redis://localhost:6379/15
+"""
+import argparse
+import asyncio
+import logging
+import sys
+import uuid
+from typing import List, Optional
+
+import livechat
+from livechat import ConnectionManager
+from livechat_backend import RedisBackend
+
+# Cross-worker messages go through pub/sub, so nothing arrives instantly
+TIMEOUT = 2.0
+
+class CheckFailed(Exception):
+    pass
+
+class _State:
+    def __init__(self, name: str):
+        self.name = name
+
+class FakeWebSocket:
+    """Stands in for a Starlette WebSocket; keeps every message sent to it."""
+
+    def __init__(self):
+        self.client_state = _State("CONNECTED")
+        self.received: List[dict] = []
+        self._arrived = asyncio.Event()
+
+    async def accept(self):
+        pass
+
+    async def send_json(self, data: dict):
+        self.received.append(data)
+        self._arrived.set()
+
+    async def close(self, code: int = 1000):
+        self.client_state = _State("DISCONNECTED")
+
+    def messages(self, type_: str, **fields) -> List[dict]:
+        return [m for m in self.received if m.get("type") == type_ and all(m.get(k) == v for k, v in fields.items())]
+
+    async def expect(self, type_: str, **fields) -> dict:
+        """Waits up to TIMEOUT for a message of this type with these field values."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + TIMEOUT
+        while not self.messages(type_, **fields):
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise CheckFailed(f"expected {type_} {fields}, got {[m.get('type') for m in self.received]}")
+            self._arrived.clear()
+            try:
+                await asyncio.wait_for(self._arrived.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+        return self.messages(type_, **fields)[0]
+
+def check(condition: bool, message: str):
+    if not condition:
+        raise CheckFailed(message)
+
+async def settle():
+    """Gives published events time to reach the other worker, for checks that something did NOT happen."""
+    await asyncio.sleep(0.2)
+
+class Workers:
+    """Two managers sharing one Redis, and the fake sockets connected to them by client id."""
+
+    def __init__(self, managers: List[ConnectionManager]):
+        self.managers = managers
+        self.sockets = {}
+
+    async def connect(self, worker: int, client_id: str, client_type: str, max_chats: Optional[int] = None) -> FakeWebSocket:
+        ws = self.sockets[client_id] = FakeWebSocket()
+        await self.managers[worker].connect(ws, client_id, client_type, max_chats)
+        return ws
+
+    async def request_chat(self, worker: int, user_id: str) -> FakeWebSocket:
+        ws = await self.connect(worker, user_id, "user")
+        await self.managers[worker].add_to_wait_queue(user_id)
+        return ws
+
+    async def agent_of(self, user_id: str) -> Optional[str]:
+        agents = {await manager.backend.get_agent_for(user_id) for manager in self.managers}
+        check(len(agents) == 1, f"workers disagree on {user_id}'s agent: {agents}")
+        return agents.pop()
+
+    async def queue(self) -> List[str]:
+        return (await self.managers[0].backend.get_queue())[1]
+
+async def cross_worker_pairing(w: Workers):
+    """A user on one worker is paired with a free agent on the other, and messages flow both ways."""
+    agent = await w.connect(0, "agent-a", "agent", max_chats=1)
+    user = await w.request_chat(1, "user-1")
+    await user.expect("chat_started")
+    await agent.expect("chat_accepted", user_id="user-1", auto=True)
+    check(await w.agent_of("user-1") == "agent-a", "user-1 is not paired with agent-a")
+
+    await w.managers[1].relay_message("user-1", {"content": "hello from worker 1"})
+    await agent.expect("message", user_id="user-1", content="hello from worker 1")
+    await w.managers[0].relay_message("agent-a", {"user_id": "user-1", "content": "hello from worker 0"})
+    await user.expect("message", content="hello from worker 0")
+
+async def assignment_within_capacity(w: Workers):
+    """Users on both workers fill both workers' agents up to capacity; the rest wait in order and get the next free slot."""
+    agents = [await w.connect(0, "agent-a", "agent", max_chats=2), await w.connect(1, "agent-b", "agent", max_chats=1)]
+    users = [await w.request_chat(i % 2, f"user-{i}") for i in range(5)]
+    for user in users[:3]:
+        await user.expect("chat_started")
+    await settle()
+    accepted = [len(agent.messages("chat_accepted")) for agent in agents]
+    check(accepted == [2, 1], f"agents were given {accepted} chats for capacities [2, 1]")
+    check(not users[3].messages("chat_started") and not users[4].messages("chat_started"), "a user beyond capacity was paired")
+    check(await w.queue() == ["user-3", "user-4"], f"wait queue is {await w.queue()}, expected user-3 then user-4")
+    await agents[0].expect("queue_add", user_id="user-3")  # user-3 queued on worker 1, agent-a is on worker 0
+
+    # A user leaving a chat frees their agent, which takes the longest-waiting user
+    freed = await w.agent_of("user-0")
+    await w.managers[0].disconnect("user-0")
+    await users[3].expect("chat_started")
+    check(await w.agent_of("user-3") == freed, f"user-3 went to {await w.agent_of('user-3')}, not the freed {freed}")
+    check(await w.queue() == ["user-4"], f"wait queue is {await w.queue()}, expected only user-4")
+
+async def queued_user_disconnect(w: Workers):
+    """A waiting user who leaves drops out of the queue for agents on both workers and is never assigned."""
+    # Capacity 0 pauses auto-assignment, so both users wait
+    agents = [await w.connect(0, "agent-a", "agent", max_chats=0), await w.connect(1, "agent-b", "agent", max_chats=0)]
+    await w.request_chat(1, "user-1")
+    waiting = await w.request_chat(0, "user-2")
+    await agents[0].expect("queue_add", user_id="user-1")
+    await agents[1].expect("queue_add", user_id="user-2")
+
+    await w.managers[1].disconnect("user-1")
+    check(await w.queue() == ["user-2"], f"wait queue is {await w.queue()} after user-1 left, expected only user-2")
+    for agent in agents:
+        await agent.expect("queue_remove", user_id="user-1")
+
+    # The next free slot goes to the user still waiting, not the one who left
+    await w.managers[0].set_capacity("agent-a", 1)
+    await waiting.expect("chat_started")
+    await agents[0].expect("chat_accepted", user_id="user-2")
+    check(await w.agent_of("user-1") is None, "user-1 was paired after leaving")
+
+async def concurrent_accepts(w: Workers):
+    """Two agents on different workers accepting the same waiting user at once: exactly one chat starts."""
+    # Capacity 0 pauses auto-assignment, so the user waits for a manual accept
+    agents = [await w.connect(0, "agent-a", "agent", max_chats=0), await w.connect(1, "agent-b", "agent", max_chats=0)]
+    user = await w.request_chat(0, "user-1")
+    await agents[1].expect("queue_add", user_id="user-1")
+
+    await asyncio.gather(w.managers[0].accept_chat("agent-a", "user-1"), w.managers[1].accept_chat("agent-b", "user-1"))
+    await user.expect("chat_started")
+    await settle()
+    winners = [agent_id for agent_id, agent in zip(("agent-a", "agent-b"), agents) if agent.messages("chat_accepted")]
+    check(len(winners) == 1, f"accepted by {winners or 'nobody'}")
+    check(len(user.messages("chat_started")) == 1, f"user-1 got {len(user.messages('chat_started'))} chat_started")
+    check(await w.agent_of("user-1") == winners[0], "the pairing doesn't match the agent told it accepted")
+    check(await w.queue() == [], "user-1 is still queued")
+
+async def agent_disconnect(w: Workers):
+    """An agent going away ends its chats on both workers, and a waiting user goes to the next agent to connect."""
+    await w.connect(0, "agent-a", "agent", max_chats=2)
+    users = [await w.request_chat(0, "user-1"), await w.request_chat(1, "user-2")]
+    for user in users:
+        await user.expect("chat_started")
+
+    await w.managers[0].disconnect("agent-a")
+    for user in users:
+        await user.expect("chat_ended")
+    stats = await w.managers[1].backend.get_stats()
+    check(stats["active_chats"] == 0 and stats["online_agents"] == 0 and stats["available_agents"] == 0,
+          f"agent-a's state outlived it: {stats}")
+
+    waiting = await w.request_chat(1, "user-3")
+    check(await w.queue() == ["user-3"], "user-3 wasn't queued with no agents online")
+    agent = await w.connect(0, "agent-b", "agent", max_chats=1)
+    await waiting.expect("chat_started")
+    await agent.expect("chat_accepted", user_id="user-3", auto=True)
+
+SCENARIOS = [cross_worker_pairing, assignment_within_capacity, queued_user_disconnect, concurrent_accepts, agent_disconnect]
+
+async def _run_scenario(scenario, redis_url: Optional[str]) -> Optional[str]:
+    """Runs one scenario on a fresh pair of workers; returns what went wrong, or None."""
+    prefix = f"campus:livechat-check:{uuid.uuid4().hex[:8]}"
+    if redis_url:
+        backends = [RedisBackend(redis_url, prefix) for _ in range(2)]
+    else:
+        import fakeredis
+        server = fakeredis.FakeServer()
+        backends = [RedisBackend("", prefix, client=fakeredis.FakeAsyncRedis(server=server, decode_responses=True))
+                    for _ in range(2)]
+    managers = [ConnectionManager(backend) for backend in backends]
+    for manager in managers:
+        await manager.start()
+    try:
+        await scenario(Workers(managers))
+        return None
+    except CheckFailed as e:
+        return str(e)
+    finally:
+        async for key in backends[0].client.scan_iter(f"{prefix}:*"):
+            await backends[0].client.delete(key)
+        for manager in managers:
+            await manager.stop()
+
+async def run(redis_url: Optional[str]) -> int:
+    failures = 0
+    for scenario in SCENARIOS:
+        error = await _run_scenario(scenario, redis_url)
+        summary = scenario.__doc__.strip()
+        if error is None:
+            print(f"PASS {scenario.__name__}: {summary}")
+        else:
+            failures += 1
+            print(f"FAIL {scenario.__name__}: {summary}\n     {error}")
+    return failures
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--redis-url", help="a real Redis to check against instead of fakeredis")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+    if not livechat.AUTO_ASSIGN:
+        print("LIVECHAT_AUTO_ASSIGN=0: these scenarios rely on auto-assignment; unset it to run them.")
+        return 1
+    failures = asyncio.run(run(args.redis_url))
+    print(f"{len(SCENARIOS) - failures}/{len(SCENARIOS)} scenarios passed")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
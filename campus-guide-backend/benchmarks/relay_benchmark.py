@@ -0,0 +1,108 @@
+# benchmarks/relay_benchmark.py
+"""
+Load benchmark for ConnectionManager message relay.
+
+Pairs N users with N agents on fake sockets (each send takes --send-latency seconds),
+has every user send --messages messages, and reports relay throughput. --stalled makes
+that many extra agents' sockets hang forever, to show they don't hold up other chats.
+
+Run from campus-guide-backend:
+    python -m benchmarks.relay_benchmark --pairs 500 --messages 50
+"""
+import argparse
+import asyncio
+import time
+
+from livechat import ConnectionManager
+from livechat_backend import LocalBackend
+
+class _State:
+    def __init__(self, name: str):
+        self.name = name
+
+class FakeWebSocket:
+    """Stands in for a Starlette WebSocket; counts delivered messages."""
+
+    def __init__(self):
+        self.send_latency = 0.0
+        self.stalled = False
+        self.client_state = _State("CONNECTED")
+        self.received = 0
+        self.done = asyncio.Event()
+        self.expected = None
+
+    async def accept(self):
+        pass
+
+    async def send_json(self, data: dict):
+        if self.stalled:
+            await asyncio.Event().wait()
+        if self.send_latency:
+            await asyncio.sleep(self.send_latency)
+        if data.get("type") == "message":
+            self.received += 1
+            if self.received == self.expected:
+                self.done.set()
+
+    async def close(self, code: int = 1000):
+        self.client_state = _State("DISCONNECTED")
+
+async def run(pairs: int, messages: int, send_latency: float, stalled: int) -> dict:
+    manager = ConnectionManager(LocalBackend())
+    await manager.start()
+
+    # Pair everyone up with instant sockets so the setup's queue broadcasts aren't timed
+    sockets = []
+    for i in range(pairs + stalled):
+        agent_ws, user_ws = FakeWebSocket(), FakeWebSocket()
+        await manager.connect(agent_ws, f"agent-{i}", "agent")
+        await manager.connect(user_ws, f"user-{i}", "user")
+        await manager.add_to_wait_queue(f"user-{i}")
+        await manager.accept_chat(f"agent-{i}", f"user-{i}")
+        sockets += [agent_ws, user_ws]
+        await asyncio.sleep(0)  # let writer tasks drain the queue broadcasts
+
+    agents = sockets[0::2]
+    for ws in sockets:
+        ws.send_latency = send_latency
+    for i, ws in enumerate(agents):
+        ws.stalled = i >= pairs
+        ws.expected = messages
+
+    async def user_sends(i: int):
+        for n in range(messages):
+            await manager.relay_message(f"user-{i}", {"content": f"message {n}"})
+            if n % 10 == 0:
+                await asyncio.sleep(0)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user_sends(i) for i in range(pairs + stalled)))
+    try:
+        await asyncio.wait_for(asyncio.gather(*(ws.done.wait() for ws in agents[:pairs])), timeout=60)
+    except asyncio.TimeoutError:
+        # Agents whose buffer overflowed were disconnected and will never catch up
+        print(f"Timed out; {sum(not ws.done.is_set() for ws in agents[:pairs])} agents incomplete "
+              f"(raise LIVECHAT_OUTBOUND_QUEUE_SIZE or lower --messages)")
+    elapsed = time.perf_counter() - started
+
+    await manager.stop()
+    delivered = sum(ws.received for ws in agents[:pairs])
+    return {
+        "pairs": pairs,
+        "stalled_agents": stalled,
+        "messages_delivered": delivered,
+        "seconds": round(elapsed, 3),
+        "messages_per_second": round(delivered / elapsed, 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pairs", type=int, default=300)
+    parser.add_argument("--messages", type=int, default=50, help="messages sent by each user")
+    parser.add_argument("--send-latency", type=float, default=0.001, help="seconds per socket send")
+    parser.add_argument("--stalled", type=int, default=0, help="extra pairs whose agent socket never drains")
+    args = parser.parse_args()
+    print(asyncio.run(run(args.pairs, args.messages, args.send_latency, args.stalled)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,363 @@
+# benchmarks/run_benchmarks.py
+"""
+End-to-end benchmark suite for the backend.
+
+Builds a synthetic campus database, boots the FastAPI app under uvicorn in a separate process
+with benchmarks.fake_gemini standing in for Gemini, and drives it over real HTTP and WebSocket
+connections:
+
+    chat          POST /chat with a mix of template answers, Gemini calls and cached repeats
+    chat_stream   POST /chat/stream, time to first chunk and to the end of the stream
+    feedback      POST /feedback
+    livechat      /ws/livechat with N users and M agents; user -> agent message latency
+
+Each scenario reports throughput and p50/p95/p99 latency in milliseconds; the run also reports
+the server's peak RSS. The load generator runs in this process, on its own interpreter and GIL,
+so the numbers are the server's; they are meant for comparing runs on the same machine. Results
+are compared against benchmarks/baselines.json and the exit status is 1 if throughput, a median
+or memory regressed by more than --tolerance, or a p95/p99 by more than --tail-tolerance (tails
+swing with scheduling noise); latency increases under --min-regression-ms are ignored.
+--save-baseline records the current run instead.
+
+Run from campus-guide-backend:
+    python -m benchmarks.run_benchmarks
+    python -m benchmarks.run_benchmarks --quick --save-baseline
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import resource
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional
+
+import httpx
+import uvicorn
+import websockets
+
+from benchmarks import fake_gemini, synthetic_campus
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baselines.json")
+
+# Metrics where a higher value is better; every other metric is a latency
+HIGHER_IS_BETTER = {"throughput"}
+# Tail latencies are gated with --tail-tolerance instead of --tolerance
+TAIL_PERCENTILES = ("p95", "p99")
+
+TEMPLATE_QUERIES = ["Where is the Library?", "where is the canteen", "Who is Dr. Mehta?", "Tell me about course SYN0042", "where is the librray"]
+CACHED_QUERIES = ["What are the library opening hours?", "Is there a gym on campus?"]
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0}
+    if len(samples) == 1:
+        samples = samples * 2
+    cuts = statistics.quantiles(samples, n=100, method="inclusive")
+    return {"p50": round(cuts[49], 2), "p95": round(cuts[94], 2), "p99": round(cuts[98], 2)}
+
+def summarize(latencies_ms: List[float], elapsed: float, errors: int) -> Dict[str, float]:
+    return {"throughput": round(len(latencies_ms) / elapsed, 1) if elapsed else 0.0, **percentiles(latencies_ms), "errors": errors}
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _serve(port: int, db_path: str, llm_latency: float, llm_tokens_per_second: float, stop, stats):
+    """Server process entry point: runs the app until stop is set, then reports its own stats."""
+    fake_gemini.install(llm_latency, llm_tokens_per_second)
+    import database
+    database.DB_NAME = db_path
+    import app as app_module
+    logging.getLogger().setLevel(logging.WARNING)
+    config = uvicorn.Config(app_module.app, host="127.0.0.1", port=port, log_level="warning", access_log=False)
+    server = uvicorn.Server(config)
+
+    # Not SIGTERM: uvicorn re-raises it after shutting down, which would kill us before reporting
+    def wait_for_stop():
+        stop.wait()
+        server.should_exit = True
+    threading.Thread(target=wait_for_stop, daemon=True).start()
+    server.run()
+    stats.put({"peak_rss_mb": peak_rss_mb(), "llm_calls": fake_gemini.FakeGenerativeModel.calls})
+
+class ServerProcess:
+    """Runs the app under uvicorn in a child process, so client and server don't share a GIL."""
+
+    def __init__(self, port: int, db_path: str, llm_latency: float, llm_tokens_per_second: float):
+        self.port = port
+        context = multiprocessing.get_context("spawn")
+        self.stop = context.Event()
+        self.stats = context.Queue()
+        self.process = context.Process(target=_serve, name="benchmark-server", daemon=True,
+                                       args=(port, db_path, llm_latency, llm_tokens_per_second, self.stop, self.stats))
+        self.server_stats: Dict[str, float] = {}
+
+    def __enter__(self):
+        self.process.start()
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                httpx.get(f"http://127.0.0.1:{self.port}/", timeout=1).raise_for_status()
+                return self
+            except httpx.HTTPError:
+                if time.monotonic() > deadline or not self.process.is_alive():
+                    self.process.kill()
+                    raise RuntimeError("Benchmark server failed to start")
+                time.sleep(0.1)
+
+    def __exit__(self, *exc):
+        # A graceful shutdown, so the app's lifespan flushes the feedback writer as in production
+        self.stop.set()
+        try:
+            self.server_stats = self.stats.get(timeout=30)
+        except queue.Empty:
+            pass
+        self.process.join(30)
+        if self.process.is_alive():
+            self.process.kill()
+
+async def _run_workers(concurrency: int, total: int, job) -> Dict[str, float]:
+    latencies: List[float] = []
+    errors = 0
+    counter = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            started = time.perf_counter()
+            try:
+                await job(i)
+                latencies.append((time.perf_counter() - started) * 1000)
+            except Exception as e:
+                errors += 1
+                if errors == 1:
+                    print(f"  first error: {e!r}")
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, time.perf_counter() - started, errors)
+
+def _chat_query(i: int) -> str:
+    # 50% template answers, 25% repeats the response cache should absorb, 25% distinct Gemini calls
+    bucket = i % 4
+    if bucket < 2:
+        return TEMPLATE_QUERIES[i % len(TEMPLATE_QUERIES)]
+    if bucket == 2:
+        return CACHED_QUERIES[i % len(CACHED_QUERIES)]
+    return f"Can you suggest something to do on campus this weekend, idea number {i}?"
+
+async def bench_chat(client: httpx.AsyncClient, concurrency: int, total: int) -> Dict[str, float]:
+    async def job(i: int):
+        response = await client.post("/chat", json={"message": _chat_query(i), "target_lang": "en"})
+        response.raise_for_status()
+    return await _run_workers(concurrency, total, job)
+
+async def bench_chat_stream(client: httpx.AsyncClient, concurrency: int, total: int) -> Dict[str, float]:
+    first_chunk_ms: List[float] = []
+
+    async def job(i: int):
+        started = time.perf_counter()
+        first_chunk = None
+        payload = {"message": f"What clubs can I join, question {i}?", "target_lang": "en"}
+        async with client.stream("POST", "/chat/stream", json=payload) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if first_chunk is None and line.startswith("event: chunk"):
+                    first_chunk = (time.perf_counter() - started) * 1000
+        if first_chunk is not None:
+            first_chunk_ms.append(first_chunk)
+
+    result = await _run_workers(concurrency, total, job)
+    result.update({f"first_chunk_{k}": v for k, v in percentiles(first_chunk_ms).items()})
+    return result
+
+async def bench_feedback(client: httpx.AsyncClient, concurrency: int, total: int) -> Dict[str, float]:
+    async def job(i: int):
+        response = await client.post("/feedback", json={"session_id": f"bench-{i % 50}", "rating": i % 5 + 1, "comment": "benchmark"})
+        response.raise_for_status()
+    return await _run_workers(concurrency, total, job)
+
+async def bench_livechat(base_url: str, users: int, agents: int, messages: int, rate: float) -> Dict[str, float]:
+    """
+    The server assigns each queued user to an agent (agents take enough chats at once for every
+    user); each user then sends `messages` messages at `rate` per second. Latency is measured from
+    the user's send to the agent's receive, time to agent from request_chat to chat_started.
+    With LIVECHAT_AUTO_ASSIGN=0 agents instead accept the queued users whose number maps to them.
+    """
+    import livechat
+    run_id = uuid.uuid4().hex[:8]
+    max_chats = -(-users // agents)
+    latencies: List[float] = []
+    wait_ms: List[float] = []
+    expected = users * messages
+    all_received = asyncio.Event()
+    errors = 0
+
+    async def agent(index: int, ready: asyncio.Event):
+        url = f"{base_url}/ws/livechat/agent/bench-{run_id}-agent-{index}?max_chats={max_chats}"
+        async with websockets.connect(url, max_queue=None) as ws:
+            ready.set()
+            async for raw in ws:
+                msg = json.loads(raw)
+                if msg["type"] == "queue_add" and not livechat.AUTO_ASSIGN:
+                    user_number = int(msg["user_id"].rsplit("-", 1)[1])
+                    if user_number % agents == index:
+                        await ws.send(json.dumps({"type": "accept_chat", "user_id": msg["user_id"]}))
+                elif msg["type"] == "message":
+                    latencies.append((time.perf_counter() - float(msg["content"])) * 1000)
+                    if len(latencies) == expected:
+                        all_received.set()
+                if all_received.is_set():
+                    return
+
+    async def user(index: int):
+        nonlocal errors
+        try:
+            async with websockets.connect(f"{base_url}/ws/livechat/user/bench-{run_id}-user-{index}") as ws:
+                requested = time.perf_counter()
+                await ws.send(json.dumps({"type": "request_chat"}))
+                while json.loads(await ws.recv())["type"] != "chat_started":
+                    pass
+                wait_ms.append((time.perf_counter() - requested) * 1000)
+                for _ in range(messages):
+                    await ws.send(json.dumps({"type": "message", "content": repr(time.perf_counter())}))
+                    await asyncio.sleep(1 / rate)
+                await asyncio.wait_for(all_received.wait(), timeout=60)
+        except Exception:
+            errors += 1
+
+    readies = [asyncio.Event() for _ in range(agents)]
+    agent_tasks = [asyncio.create_task(agent(i, readies[i])) for i in range(agents)]
+    await asyncio.gather(*(r.wait() for r in readies))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user(i) for i in range(users)))
+    elapsed = time.perf_counter() - started
+    for task in agent_tasks:
+        task.cancel()
+    await asyncio.gather(*agent_tasks, return_exceptions=True)
+
+    result = summarize(latencies, elapsed, errors + expected - len(latencies))
+    result.update({f"time_to_agent_{k}": v for k, v in percentiles(wait_ms).items()})
+    return result
+
+async def run_scenarios(base_url: str, args) -> Dict[str, Dict[str, float]]:
+    results = {}
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        results["chat"] = await bench_chat(client, args.concurrency, args.requests)
+        results["chat_stream"] = await bench_chat_stream(client, args.concurrency, args.requests // 4)
+        results["feedback"] = await bench_feedback(client, args.concurrency, args.requests)
+    ws_url = base_url.replace("http://", "ws://")
+    results["livechat"] = await bench_livechat(ws_url, args.users, args.agents, args.messages, args.message_rate)
+    return results
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]], tolerance: float,
+            tail_tolerance: float, min_regression_ms: float = 0.0) -> List[str]:
+    """
+    Returns a description of every metric that is worse than the baseline by more than tolerance,
+    or for p95/p99 latencies, by more than tail_tolerance. Latencies must also be worse by at least
+    min_regression_ms, so jitter on a few-millisecond metric isn't reported.
+    """
+    regressions = []
+    for scenario, metrics in baseline.items():
+        for metric, expected in metrics.items():
+            actual = results.get(scenario, {}).get(metric)
+            if actual is None or metric == "errors" or not expected:
+                continue
+            allowed = tail_tolerance if metric.endswith(TAIL_PERCENTILES) else tolerance
+            if metric in HIGHER_IS_BETTER:
+                worse = actual < expected * (1 - allowed)
+            elif scenario == "process":
+                worse = actual > expected * (1 + allowed)
+            else:
+                worse = actual > max(expected * (1 + allowed), expected + min_regression_ms)
+            if worse:
+                regressions.append(f"{scenario}.{metric}: {actual} vs baseline {expected}")
+        errors = results.get(scenario, {}).get("errors", 0)
+        if errors > metrics.get("errors", 0):
+            regressions.append(f"{scenario}.errors: {errors} vs baseline {metrics.get('errors', 0)}")
+    return regressions
+
+def print_report(results: Dict[str, Dict[str, float]]):
+    for scenario, metrics in results.items():
+        line = ", ".join(f"{metric}={value}" for metric, value in metrics.items())
+        print(f"{scenario:12} {line}")
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--quick", action="store_true", help="small database and workload, for a fast sanity check")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--agents", type=int, default=20)
+    parser.add_argument("--messages", type=int, default=20, help="messages per live-chat user")
+    parser.add_argument("--message-rate", type=float, default=10.0, help="messages per second per live-chat user")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="fake Gemini seconds before the first token")
+    parser.add_argument("--llm-tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--locations", type=int, default=5000)
+    parser.add_argument("--faculty", type=int, default=500)
+    parser.add_argument("--courses", type=int, default=2000)
+    parser.add_argument("--events", type=int, default=300)
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed relative regression of throughput, medians and memory before failing")
+    parser.add_argument("--tail-tolerance", type=float, default=1.0, help="allowed relative regression of p95/p99 latencies")
+    parser.add_argument("--min-regression-ms", type=float, default=25.0, help="latency increases smaller than this never fail")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    args = parser.parse_args(argv)
+    profile = "quick" if args.quick else "full"
+    if args.quick:
+        args.requests, args.users, args.agents, args.messages = 400, 40, 5, 10
+        args.locations, args.faculty, args.courses, args.events = 1000, 100, 400, 60
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "campus.db")
+        started = time.perf_counter()
+        sizes = synthetic_campus.build(db_path, args.locations, args.faculty, args.courses, args.events)
+        print(f"Synthetic database {sizes} built in {time.perf_counter() - started:.1f}s")
+
+        with ServerProcess(_free_port(), db_path, args.llm_latency, args.llm_tokens_per_second) as server:
+            results = asyncio.run(run_scenarios(f"http://127.0.0.1:{server.port}", args))
+
+    results["process"] = server.server_stats
+    print_report(results)
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+    if args.save_baseline:
+        baselines[profile] = results
+        with open(args.baseline, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Saved {profile} baseline to {args.baseline}")
+        return 0
+    if profile not in baselines:
+        print(f"No {profile} baseline in {args.baseline}; run with --save-baseline to create one.")
+        return 0
+    # llm_calls is informational: it moves with the cache and intent hit rates, not with speed
+    baseline = {k: {m: v for m, v in metrics.items() if m != "llm_calls"} for k, metrics in baselines[profile].items()}
+    regressions = compare(results, baseline, args.tolerance, args.tail_tolerance, args.min_regression_ms)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,45 @@
+# benchmarks/synthetic_campus.py
+"""
+Builds a large synthetic campus database: the regular schema and seed data from
+setup_database, plus generated locations, faculty, courses and events.
+"""
+import random
+import sqlite3
+from typing import Dict
+
+import setup_database
+
+BLOCKS = "ABCDEFGHJK"
+DEPARTMENTS = ["Computer Science", "Mechanical", "Electronics", "Civil", "Electrical", "Chemical", "Mathematics", "Physics"]
+ROOM_KINDS = ["Lab", "Lecture Hall", "Seminar Room", "Office", "Tutorial Room", "Studio"]
+SURNAMES = ["Mehta", "Rao", "Sharma", "Iyer", "Patil", "Desai", "Kulkarni", "Nair", "Joshi", "Gupta", "Khan", "Fernandes"]
+
+def build(db_name: str, locations: int = 5000, faculty: int = 500, courses: int = 2000, events: int = 300, seed: int = 7) -> Dict[str, int]:
+    """Creates db_name with the given number of extra rows per table; returns the table sizes."""
+    rng = random.Random(seed)
+    setup_database.setup(db_name)
+    conn = sqlite3.connect(db_name)
+    with conn:
+        conn.executemany(
+            "INSERT OR IGNORE INTO locations (name, details) VALUES (?, ?)",
+            ((f"{rng.choice(DEPARTMENTS)} {rng.choice(ROOM_KINDS)} {i}",
+              f"Block {rng.choice(BLOCKS)}, floor {rng.randint(0, 6)}, room {rng.randint(1, 40)}") for i in range(locations)),
+        )
+        conn.executemany(
+            "INSERT OR IGNORE INTO faculty (name, department, location, contact) VALUES (?, ?, ?, ?)",
+            ((f"Dr. {rng.choice(SURNAMES)} {i}", rng.choice(DEPARTMENTS), f"Room {rng.randint(100, 699)}, Block {rng.choice(BLOCKS)}",
+              f"faculty{i}@example.edu") for i in range(faculty)),
+        )
+        conn.executemany(
+            "INSERT OR IGNORE INTO courses (code, name, department, instructor, description, credits) VALUES (?, ?, ?, ?, ?, ?)",
+            ((f"SYN{i:04d}", f"{rng.choice(DEPARTMENTS)} Topics {i}", rng.choice(DEPARTMENTS), f"Dr. {rng.choice(SURNAMES)} {rng.randrange(faculty or 1)}",
+              "A generated course used for benchmarking.", rng.randint(1, 5)) for i in range(courses)),
+        )
+        conn.executemany(
+            "INSERT OR IGNORE INTO events (name, venue, date, description) VALUES (?, ?, ?, ?)",
+            ((f"Campus Event {i}", f"Auditorium {rng.choice(BLOCKS)}", f"2030-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+              "A generated event used for benchmarking.") for i in range(events)),
+        )
+    sizes = {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in ("locations", "faculty", "courses", "events")}
+    conn.close()
+    return sizes
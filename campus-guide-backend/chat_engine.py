@@ -0,0 +1,195 @@
+# chat_engine.py
+import os
+import time
+import asyncio
+import datetime
+import logging
+import threading
+from typing import List, Dict, Any, Optional, Tuple, Set
+
+import google.generativeai as genai
+from google.generativeai import caching
+
+import database
+import intents
+import retrieval
+
+logger = logging.getLogger(__name__)
+
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+# With GEMINI_CONTEXT_CACHE=1 the instructions and every campus record are stored once per data
+# version with Gemini's context caching, and prompts carry only the question and history.
+# Gemini refuses caches below a minimum size, so small campuses keep the retrieval prompt.
+GEMINI_CONTEXT_CACHE = os.getenv("GEMINI_CONTEXT_CACHE", "0") == "1"
+GEMINI_CONTEXT_CACHE_TTL_SECONDS = int(os.getenv("GEMINI_CONTEXT_CACHE_TTL_SECONDS", "3600"))
+GEMINI_CONTEXT_CACHE_MIN_TOKENS = 1024
+# A cache is refreshed at 80% of its TTL and not used past 95%, in case the refresh fails.
+# Failed builds are retried with exponential backoff from the first to the second delay.
+GEMINI_CONTEXT_CACHE_RETRY_SECONDS = (30.0, 900.0)
+
+ESCALATION_RESPONSE = "I am unable to answer your question. Would you like to talk to a person?"
+ESCALATION_MARKER = "Would you like to talk to a person?"
+
+# The unchanging part of every answer prompt, sent as the model's system instruction
+SYSTEM_INSTRUCTION = """You are CampusGuide AI, an intelligent assistant for {college_name}.
+Your primary goal is to provide concise, accurate, and friendly information to students and visitors.
+You MUST respond in the language named in each request.
+
+**IMPORTANT ESCALATION RULE**:
+If you absolutely cannot answer the user's question with the provided database information,
+or if the user seems frustrated, your ONLY response MUST be this exact English phrase:
+`{escalation}`
+Do not translate this specific phrase. Do not add any other text."""
+
+def render_prompt(language_name: str, user_query: str, campus_context: str, history: str) -> str:
+    """The per-request part of an answer prompt (an f-string is compiled once, and beats str.format)."""
+    return f"""Respond in: {language_name}.
+
+Current User Query: "{user_query}"
+
+Use the following database information to answer the query if relevant:
+{campus_context}
+
+Conversation History (for context):
+{history}
+
+Your Answer (in {language_name}, unless the escalation rule applies):"""
+
+CACHED_CONTEXT_NOTE = "(all campus records are in the cached context above)"
+
+class ChatEngine:
+    """
+    Long-lived Gemini clients and prompt construction, shared by every request.
+
+    The answer model carries the static instructions as its system instruction and is only
+    rebuilt if the college name changes. start() warms the snapshot, search, retrieval and
+    intent indexes and the clients so the first request doesn't pay for them.
+    """
+
+    def __init__(self, model_name: str = GEMINI_MODEL, context_cache: bool = GEMINI_CONTEXT_CACHE):
+        self.model_name = model_name
+        self.context_cache = context_cache
+        self.plain_model = genai.GenerativeModel(model_name)  # summaries and other non-answer prompts
+        self._answer_model = None
+        self._college_name: Optional[str] = None
+        # (snapshot, model, cache, created_at) once a context cache is ready
+        self._cached: Optional[Tuple[Dict[str, Any], Any, Any, float]] = None
+        self._cache_building: Optional[Dict[str, Any]] = None  # snapshot a cache is being built for
+        self._cache_skipped: Optional[Dict[str, Any]] = None  # snapshot too small to cache
+        self._cache_failures = 0  # consecutive failed builds
+        self._cache_retry_at = 0.0  # monotonic time before which no build is attempted
+        self._cache_lock = threading.Lock()
+        self._tasks: Set[asyncio.Task] = set()
+        self.stats = {"model_builds": 0, "cache_builds": 0, "cache_failures": 0, "cached_prompts": 0}
+
+    async def start(self):
+        started = time.perf_counter()
+        campus_data = await asyncio.to_thread(self._warm_up)
+        if self.context_cache:
+            self._schedule_cache(campus_data)
+        logger.info(f"Chat engine warmed up in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    async def stop(self):
+        for task in list(self._tasks):
+            task.cancel()
+        cached, self._cached = self._cached, None
+        if cached is not None:
+            await asyncio.to_thread(self._delete_cache, cached[2])
+
+    def _warm_up(self) -> Dict[str, Any]:
+        campus_data, _ = database.get_all_data_for_prompt()
+        retrieval.warm_up(campus_data)
+        intents.warm_up(campus_data)
+        database.find_location("library")  # opens the pooled connection and prepares the search query
+        self._model_for(campus_data)
+        return campus_data
+
+    def _system_instruction(self, college_name: str) -> str:
+        return SYSTEM_INSTRUCTION.format(college_name=college_name, escalation=ESCALATION_RESPONSE)
+
+    def _model_for(self, campus_data: Dict[str, Any]):
+        college_name = (campus_data.get("college_info") or {}).get("name") or "the college"
+        if self._answer_model is None or college_name != self._college_name:
+            self._answer_model = genai.GenerativeModel(self.model_name, system_instruction=self._system_instruction(college_name))
+            self._college_name = college_name
+            self.stats["model_builds"] += 1
+        return self._answer_model
+
+    def prepare(self, user_query: str, history: List[Dict[str, str]], language_name: str, campus_data: Dict[str, Any]) -> Tuple[Any, str]:
+        """Returns the model and prompt to answer this turn with. Call from the event loop."""
+        formatted_history = "\n".join(f"{msg['role'].capitalize()}: {msg['content']}" for msg in history)
+        cached = self._cached
+        if self.context_cache:
+            self._schedule_cache(campus_data)
+        if cached is not None and cached[0] is campus_data and self._cache_age(cached) < GEMINI_CONTEXT_CACHE_TTL_SECONDS * 0.95:
+            self.stats["cached_prompts"] += 1
+            model, campus_context = cached[1], CACHED_CONTEXT_NOTE
+        else:
+            # Only the records relevant to this turn (and the previous user turn, for follow-ups) go into the prompt
+            previous_user_turns = [msg['content'] for msg in history if msg['role'] == 'user'][-1:]
+            campus_context = retrieval.build_context(" ".join(previous_user_turns + [user_query]), campus_data)
+            model = self._model_for(campus_data)
+        return model, render_prompt(language_name, user_query, campus_context, formatted_history)
+
+    # --- Context caching ---
+
+    @staticmethod
+    def _cache_age(cached: Tuple[Dict[str, Any], Any, Any, float]) -> float:
+        return time.monotonic() - cached[3]
+
+    def _schedule_cache(self, campus_data: Dict[str, Any]):
+        """
+        Starts building a cache for this snapshot unless one is current, being built, not worth
+        it, or a failed build is still backing off.
+        """
+        cached = self._cached
+        fresh = cached is not None and cached[0] is campus_data and self._cache_age(cached) < GEMINI_CONTEXT_CACHE_TTL_SECONDS * 0.8
+        if fresh or self._cache_building is campus_data or self._cache_skipped is campus_data:
+            return
+        if time.monotonic() < self._cache_retry_at:
+            return
+        self._cache_building = campus_data
+        task = asyncio.create_task(asyncio.to_thread(self._build_cache, campus_data))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _build_cache(self, campus_data: Dict[str, Any]):
+        college_name = (campus_data.get("college_info") or {}).get("name") or "the college"
+        system_instruction = self._system_instruction(college_name)
+        records = "Campus database records:\n" + retrieval.full_context(campus_data)
+        try:
+            if retrieval.estimate_tokens(system_instruction + records) < GEMINI_CONTEXT_CACHE_MIN_TOKENS:
+                self._cache_skipped = campus_data
+                return
+            cache = caching.CachedContent.create(
+                model=f"models/{self.model_name}", display_name="campus-guide", system_instruction=system_instruction,
+                contents=[records], ttl=datetime.timedelta(seconds=GEMINI_CONTEXT_CACHE_TTL_SECONDS),
+            )
+            model = genai.GenerativeModel.from_cached_content(cache)
+        except Exception as e:
+            # Not a reason to give up on this snapshot: retry later, with retrieval prompts meanwhile
+            first, longest = GEMINI_CONTEXT_CACHE_RETRY_SECONDS
+            delay = min(longest, first * 2 ** self._cache_failures)
+            self._cache_failures += 1
+            self._cache_retry_at = time.monotonic() + delay
+            self.stats["cache_failures"] += 1
+            logger.warning(f"Gemini context cache unavailable, using retrieval prompts; retrying in {delay:.0f}s: {e!r}")
+            return
+        finally:
+            if self._cache_building is campus_data:
+                self._cache_building = None
+        with self._cache_lock:
+            previous, self._cached = self._cached, (campus_data, model, cache, time.monotonic())
+        self._cache_failures = 0
+        self.stats["cache_builds"] += 1
+        if previous is not None:
+            self._delete_cache(previous[2])
+
+    def _delete_cache(self, cache):
+        try:
+            cache.delete()
+        except Exception as e:
+            logger.warning(f"Could not delete Gemini context cache: {e!r}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.stats, "context_cache_active": int(self._cached is not None)}
@@ -1,10 +1,21 @@
 # data.py
 import os
+import asyncio
+import logging
+from contextlib import aclosing
 import google.generativeai as genai
 from dotenv import load_dotenv
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Any, AsyncIterator
 import database
-import re
+import retrieval
+import intents
+import sessions
+import metrics
+import llm_dispatcher
+from chat_engine import ChatEngine, ESCALATION_RESPONSE, ESCALATION_MARKER
+from response_cache import ResponseCache
+
+logger = logging.getLogger(__name__)
 
 # Load environment variables
 load_dotenv()
@@ -21,79 +32,240 @@ LANGUAGE_MAP = {
     'fr': 'French'
 }
 
-def get_ai_response(user_query: str, history: List[Dict[str, str]], target_lang: str) -> Dict[str, Optional[str]]:
+# Per-request limit on a Gemini call, including time queued in the dispatcher and retries.
+# Prompts up to LLM_SHORT_PROMPT_TOKENS are dispatched ahead of larger ones.
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "20"))
+LLM_SHORT_PROMPT_TOKENS = int(os.getenv("LLM_SHORT_PROMPT_TOKENS", "400"))
+dispatcher = llm_dispatcher.LLMDispatcher()
+engine = ChatEngine()
+
+FALLBACK_RESPONSE = "I'm sorry, I'm having trouble connecting to my brain right now. Please try again in a moment."
+STREAM_INTERRUPTED_MESSAGE = "The answer was cut off. Please try again."
+
+response_cache = ResponseCache()
+session_store = sessions.SessionStore()
+
+def _record_usage(response: Any, prompt: str, text: str):
+    """Counts tokens from the response's usage metadata, or estimates them if it has none."""
+    if not metrics.METRICS_ENABLED:
+        return
+    usage = getattr(response, "usage_metadata", None)
+    prompt_tokens = getattr(usage, "prompt_token_count", None) or retrieval.estimate_tokens(prompt)
+    completion_tokens = getattr(usage, "candidates_token_count", None) or retrieval.estimate_tokens(text)
+    metrics.count(metrics.LLM_TOKENS, "prompt", prompt_tokens)
+    metrics.count(metrics.LLM_TOKENS, "completion", completion_tokens)
+
+def _priority(prompt: str) -> int:
+    if retrieval.estimate_tokens(prompt) <= LLM_SHORT_PROMPT_TOKENS:
+        return llm_dispatcher.PRIORITY_SHORT
+    return llm_dispatcher.PRIORITY_FULL
+
+async def _generate(model: Any, prompt: str, priority: Optional[int] = None) -> str:
     """
-    Handles response generation, including rule-based checks and translation via Gemini.
+    Calls Gemini through the dispatcher, which shares identical in-flight prompts, paces calls
+    to the quota and retries rate-limit errors. Raises after LLM_TIMEOUT_SECONDS.
     """
-    query_lower = user_query.lower()
-    map_url = None
-    college_info = database.get_college_info()
-    language_name = LANGUAGE_MAP.get(target_lang, 'English')  # Default to English
+    async def call(prompt: str) -> str:
+        response = await model.generate_content_async(prompt)
+        _record_usage(response, prompt, response.text)
+        return response.text
 
-    # --- Rule-Based Database Checks ---
-    # Location queries
-    if "where is" in query_lower or "location of" in query_lower or "find the" in query_lower:
-        # Extract the place name from the user query
-        potential_place = re.split(r'where is|location of|find the', user_query, flags=re.IGNORECASE)[-1].replace("?", "").strip()
-        location = database.find_location(potential_place)
-        
-        if location:
-            # If a location is found, set the map URL
-            if college_info and college_info.get('map_url'):
-                map_url = college_info['map_url']
-            
-            # --- EFFICIENT TRANSLATION FIX ---
-            # Instead of a second API call, create a prompt for Gemini to answer directly in the target language.
-            generative_prompt = f"""
-            You are a helpful campus assistant.
-            A user asked for the location of "{location['name']}".
-            The details for this location are: "{location['details']}".
-            Please formulate a helpful and concise response in this language: {language_name}.
-            """
-            try:
-                model = genai.GenerativeModel("gemini-2.5-flash") # Using a modern model
-                response = model.generate_content(generative_prompt)
-                return {"responseText": response.text.strip(), "mapUrl": map_url}
-            except Exception as e:
-                print(f"Error calling Gemini API for location query: {e}")
-                # Fallback to the general prompt if the specific one fails
-                pass
+    if priority is None:
+        priority = _priority(prompt)
+    try:
+        text = await asyncio.wait_for(dispatcher.generate(prompt, call, priority, LLM_TIMEOUT_SECONDS),
+                                      timeout=LLM_TIMEOUT_SECONDS)
+    except Exception:
+        metrics.count(metrics.LLM_REQUESTS, "error")
+        raise
+    metrics.count(metrics.LLM_REQUESTS, "ok")
+    return text
 
+async def _summarize(prompt: str) -> str:
+    """History summaries run in the background, so they yield to user-facing calls."""
+    return await _generate(engine.plain_model, prompt, priority=llm_dispatcher.PRIORITY_BACKGROUND)
 
-    # --- If no specific rule matches, use Gemini for a comprehensive answer ---
-    campus_data = database.get_all_data_for_prompt()
-    formatted_history = "\n".join([f"{msg['role'].capitalize()}: {msg['content']}" for msg in history])
+async def _generate_stream(model: Any, prompt: str) -> AsyncIterator[str]:
+    """Streaming counterpart of _generate; the timeout applies to the whole stream."""
+    def open_stream():
+        return model.generate_content_async(prompt, stream=True)
 
-    # Enhanced general prompt
-    prompt = f"""
-    You are CampusGuide AI, an intelligent assistant for {college_info.get('name', 'the college')}.
-    Your primary goal is to provide concise, accurate, and friendly information to students and visitors.
-    You MUST respond in the following language: {language_name}.
+    parts: List[str] = []
+    chunk = None
+    try:
+        # aclosing hands the dispatcher slot back as soon as the caller stops reading
+        async with aclosing(dispatcher.stream(open_stream, _priority(prompt), LLM_TIMEOUT_SECONDS)) as chunks:
+            async for chunk in chunks:
+                try:
+                    text = chunk.text
+                except ValueError:
+                    # Chunks without text parts (e.g. a bare finish reason)
+                    continue
+                if text:
+                    parts.append(text)
+                    yield text
+    except Exception:
+        metrics.count(metrics.LLM_REQUESTS, "error")
+        raise
+    metrics.count(metrics.LLM_REQUESTS, "ok")
+    # Streamed responses report usage on their chunks; the last one has the totals
+    _record_usage(chunk, prompt, "".join(parts))
+
+def _resolve_history(history: List[Dict[str, str]], session_id: Optional[str]) -> List[Dict[str, str]]:
+    """Uses the server-side session when there is one; either way the result fits the history budget."""
+    if session_id:
+        return session_store.history_for(session_id, history)
+    return sessions.trim_history(history)
+
+async def get_ai_response(user_query: str, history: List[Dict[str, str]], target_lang: str, session_id: Optional[str] = None) -> Dict[str, Optional[str]]:
+    """
+    Handles response generation, including rule-based checks and translation via Gemini.
+    SQLite work runs in a worker thread so the event loop stays free for WebSocket traffic.
+    Answers to first-turn questions are cached per language and campus data version.
+    With a session_id, history is kept server-side (recent turns plus a rolling summary).
+    """
+    with metrics.stage("history"):
+        history = _resolve_history(history, session_id)
+    response = await _answer(user_query, history, target_lang)
+    if session_id:
+        session_store.record_turn(session_id, user_query, response["responseText"], summarize=_summarize)
+    return response
 
-    **IMPORTANT ESCALATION RULE**:
-    If you absolutely cannot answer the user's question with the provided database information,
-    or if the user seems frustrated, your ONLY response MUST be this exact English phrase:
-    `I am unable to answer your question. Would you like to talk to a person?`
-    Do not translate this specific phrase. Do not add any other text.
+async def _answer(user_query: str, history: List[Dict[str, str]], target_lang: str) -> Dict[str, Optional[str]]:
+    with metrics.stage("db_fetch"):
+        campus_data, version = await asyncio.to_thread(database.get_all_data_for_prompt)
+    # Answers that depend on earlier turns can't be reused for other users
+    cacheable = not history and version is not None
 
-    Current User Query: "{user_query}"
+    if cacheable:
+        with metrics.stage("cache_lookup"):
+            cached = response_cache.get(user_query, target_lang, version)
+        if cached is not None:
+            metrics.count(metrics.CHAT_ANSWERS, "cache")
+            return cached
 
-    Use the following database information to answer the query if relevant:
-    {campus_data}
+    response = await _generate_response(user_query, history, target_lang, campus_data)
+    if cacheable and response["responseText"] != FALLBACK_RESPONSE:
+        response_cache.put(user_query, target_lang, version, response)
+    return response
 
-    Conversation History (for context):
-    {formatted_history}
+async def _generate_response(user_query: str, history: List[Dict[str, str]], target_lang: str, campus_data: Dict) -> Dict[str, Optional[str]]:
+    language_name = LANGUAGE_MAP.get(target_lang, 'English')  # Default to English
 
-    Your Answer (in {language_name}, unless the escalation rule applies):
-    """
+    # --- Rule-Based Answers (no Gemini call) ---
+    with metrics.stage("rule_match"):
+        rule_answer = await asyncio.to_thread(intents.answer, user_query, target_lang, campus_data)
+    if rule_answer:
+        metrics.count(metrics.CHAT_ANSWERS, "rule")
+        return rule_answer
 
+    # --- If no specific rule matches, use Gemini for a comprehensive answer ---
+    with metrics.stage("prompt_build"):
+        model, prompt = engine.prepare(user_query, history, language_name, campus_data)
     try:
-        model = genai.GenerativeModel("gemini-2.5-flash")
-        response = model.generate_content(prompt)
+        with metrics.stage("llm"):
+            response_text = await _generate(model, prompt)
         # Final safety check for escalation phrase in case the model adds extra text
-        if "Would you like to talk to a person?" in response.text:
-             return {"responseText": "I am unable to answer your question. Would you like to talk to a person?", "mapUrl": None}
-        return {"responseText": response.text.strip(), "mapUrl": map_url}
+        if ESCALATION_MARKER in response_text:
+             metrics.count(metrics.CHAT_ANSWERS, "escalation")
+             return {"responseText": ESCALATION_RESPONSE, "mapUrl": None}
+        metrics.count(metrics.CHAT_ANSWERS, "llm")
+        return {"responseText": response_text.strip(), "mapUrl": None}
     except Exception as e:
-        print(f"Error calling Gemini API: {e}")
-        return {"responseText": "I'm sorry, I'm having trouble connecting to my brain right now. Please try again in a moment.", "mapUrl": None}
\ No newline at end of file
+        logger.error(f"Error calling Gemini API: {e!r}")
+        metrics.count(metrics.CHAT_ANSWERS, "fallback")
+        return {"responseText": FALLBACK_RESPONSE, "mapUrl": None}
+
+async def stream_ai_response(user_query: str, history: List[Dict[str, str]], target_lang: str, session_id: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Streaming variant of get_ai_response. Yields events in order:
+      {"type": "meta", "mapUrl": ...}             -- sent before generation starts
+      {"type": "chunk", "text": ...}              -- zero or more, as Gemini produces them
+      {"type": "done", "responseText": ..., "mapUrl": ...}
+    A reply that turns out to be the escalation phrase ends with {"type": "escalation", "responseText": ...}
+    instead of "done"; clients should replace any text already shown with it. If Gemini fails after
+    text was sent, the stream ends with {"type": "error", "message": ...}: the text shown so far is
+    incomplete, and the turn is neither cached nor added to the session.
+    """
+    with metrics.stage("history"):
+        history = _resolve_history(history, session_id)
+    async for event in _stream_answer(user_query, history, target_lang):
+        if session_id and event["type"] in ("done", "escalation"):
+            session_store.record_turn(session_id, user_query, event["responseText"], summarize=_summarize)
+        yield event
+
+async def _stream_answer(user_query: str, history: List[Dict[str, str]], target_lang: str) -> AsyncIterator[Dict[str, Any]]:
+    with metrics.stage("db_fetch"):
+        campus_data, version = await asyncio.to_thread(database.get_all_data_for_prompt)
+    cacheable = not history and version is not None
+
+    if cacheable:
+        with metrics.stage("cache_lookup"):
+            cached = response_cache.get(user_query, target_lang, version)
+        if cached is not None:
+            metrics.count(metrics.CHAT_ANSWERS, "cache")
+            yield {"type": "meta", "mapUrl": cached["mapUrl"]}
+            yield {"type": "chunk", "text": cached["responseText"]}
+            yield {"type": "done", **cached}
+            return
+
+    language_name = LANGUAGE_MAP.get(target_lang, 'English')
+    with metrics.stage("rule_match"):
+        rule_answer = await asyncio.to_thread(intents.answer, user_query, target_lang, campus_data)
+    if rule_answer:
+        metrics.count(metrics.CHAT_ANSWERS, "rule")
+        yield {"type": "meta", "mapUrl": rule_answer["mapUrl"]}
+        yield {"type": "chunk", "text": rule_answer["responseText"]}
+        yield {"type": "done", **rule_answer}
+        if cacheable:
+            response_cache.put(user_query, target_lang, version, rule_answer)
+        return
+
+    yield {"type": "meta", "mapUrl": None}
+
+    # Hold back output while it could still be (the start of) the escalation phrase,
+    # and keep enough of a tail to spot the marker if it straddles two chunks.
+    with metrics.stage("prompt_build"):
+        model, prompt = engine.prepare(user_query, history, language_name, campus_data)
+    parts: List[str] = []
+    sent = 0
+    # For a stream the llm stage runs until the last chunk, including time the client takes to read
+    with metrics.stage("llm"):
+        try:
+            async with aclosing(_generate_stream(model, prompt)) as stream:
+                async for text in stream:
+                    parts.append(text)
+                    full_text = "".join(parts)
+                    if ESCALATION_MARKER in full_text:
+                        metrics.count(metrics.CHAT_ANSWERS, "escalation")
+                        yield {"type": "escalation", "responseText": ESCALATION_RESPONSE}
+                        return
+                    if ESCALATION_RESPONSE.startswith(full_text.lstrip()):
+                        continue
+                    safe_end = len(full_text) - (len(ESCALATION_MARKER) - 1)
+                    if safe_end > sent:
+                        yield {"type": "chunk", "text": full_text[sent:safe_end]}
+                        sent = safe_end
+        except Exception as e:
+            logger.error(f"Error streaming Gemini response: {e!r}")
+            if sent == 0:
+                metrics.count(metrics.CHAT_ANSWERS, "fallback")
+                yield {"type": "chunk", "text": FALLBACK_RESPONSE}
+                yield {"type": "done", "responseText": FALLBACK_RESPONSE, "mapUrl": None}
+            else:
+                # Part of the answer is already out; end with an error rather than passing the
+                # truncated text off as complete, and keep it out of the cache and the session.
+                metrics.count(metrics.CHAT_ANSWERS, "incomplete")
+                yield {"type": "error", "message": STREAM_INTERRUPTED_MESSAGE}
+            return
+    # Text held back as a possible start of the escalation phrase is an ordinary reply after all,
+    # as it would be from /chat, which only escalates on the marker
+    full_text = "".join(parts)
+    if len(full_text) > sent:
+        yield {"type": "chunk", "text": full_text[sent:]}
+
+    response = {"responseText": "".join(parts).strip(), "mapUrl": None}
+    metrics.count(metrics.CHAT_ANSWERS, "llm")
+    if cacheable and response["responseText"]:
+        response_cache.put(user_query, target_lang, version, response)
+    yield {"type": "done", **response}
@@ -1,56 +1,197 @@
 # database.py
 import sqlite3
 import datetime
-from typing import List, Dict, Any, Optional
+import threading
+import collections
+import functools
+import re
+import time
+import logging
+from typing import List, Dict, Any, Optional, Tuple, Set
+
+import metrics
+from setup_database import SEARCH_INDEXES
+
+logger = logging.getLogger(__name__)
 
 DB_NAME = "campus.db"
 
-def _execute_query(query: str, params: tuple = (), fetch_one: bool = False, commit: bool = False) -> Any:
-    """Helper function to execute a query with robust connection handling."""
+# --- Connection pool ---
+# Each worker thread (FastAPI runs sync endpoints in a bounded threadpool) keeps one
+# long-lived connection, so queries skip the connect/teardown and reuse prepared statements.
+PRAGMAS = {
+    "journal_mode": "WAL",   # readers don't block on the feedback writer
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,
+    "temp_store": "MEMORY",
+    "cache_size": -8000,     # in KiB
+}
+STATEMENT_CACHE_SIZE = 256
+ROW_MODES = ("dict", "tuple", "namedtuple")
+
+_local = threading.local()
+_pool: List[sqlite3.Connection] = []
+_pool_lock = threading.Lock()
+_pool_generation = 0
+
+# --- Fuzzy search ---
+# Candidates come from the FTS5 trigram indexes ranked by bm25, then are re-ranked by
+# trigram overlap so misspelt queries still resolve and unrelated rows are dropped.
+SEARCH_CANDIDATES = 20
+# A one-letter typo in a one-word name scores about 0.33; an unrelated name sharing a word, under 0.3
+MIN_SEARCH_SIMILARITY = 0.3
+_WORD_RE = re.compile(r"\w+")
+
+# --- In-memory campus snapshot ---
+# The campus tables change a few times a day, so the prompt context is loaded once
+# and served from memory until the version bumped by setup_database's triggers moves.
+# (data, version) of the cached campus snapshot, swapped as one pair so readers never mix the two
+_snapshot: Optional[Tuple[Dict[str, Any], Optional[int]]] = None
+_snapshot_lock = threading.Lock()
+_snapshot_stats = {"hits": 0, "misses": 0, "rebuilds": 0}
+
+def _get_connection() -> sqlite3.Connection:
+    """Returns this thread's pooled connection, opening it on first use."""
+    key = (DB_NAME, _pool_generation)
+    if getattr(_local, "key", None) != key:
+        # check_same_thread is off only so close_connections() can close it at shutdown.
+        conn = sqlite3.connect(DB_NAME, cached_statements=STATEMENT_CACHE_SIZE, check_same_thread=False)
+        for name, value in PRAGMAS.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        with _pool_lock:
+            _pool.append(conn)
+        _local.conn = conn
+        _local.key = key
+    return _local.conn
+
+def close_connections():
+    """Closes every pooled connection. Threads reconnect lazily on their next query."""
+    global _pool_generation
+    with _pool_lock:
+        _pool_generation += 1
+        for conn in _pool:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        _pool.clear()
+
+_QUERY_TARGET_RE = re.compile(r"\b(?:from|into|update)\s+(\w+)", re.IGNORECASE)
+
+@functools.lru_cache(maxsize=256)
+def _query_label(query: str) -> str:
+    """Metric label for a statement: its verb and first table, e.g. "select locations_fts"."""
+    verb = query.split(None, 1)[0].lower() if query.strip() else "?"
+    target = _QUERY_TARGET_RE.search(query)
+    return f"{verb} {target.group(1)}" if target else verb
+
+@functools.lru_cache(maxsize=64)
+def _namedtuple_type(columns: Tuple[str, ...]):
+    # rename=True turns columns like COUNT(*) into positional names (_0, _1, ...) instead of raising
+    return collections.namedtuple("Row", columns, rename=True)
+
+def _convert_rows(cursor: sqlite3.Cursor, rows: list, row_mode: str) -> list:
+    if row_mode == "tuple":
+        return rows
+    columns = tuple(col[0] for col in cursor.description)
+    if row_mode == "namedtuple":
+        row_type = _namedtuple_type(columns)
+        return [row_type._make(row) for row in rows]
+    return [dict(zip(columns, row)) for row in rows]
+
+def _execute_query(query: str, params: tuple = (), fetch_one: bool = False, commit: bool = False, row_mode: str = "dict") -> Any:
+    """
+    Helper function to execute a query on the calling thread's pooled connection.
+    row_mode selects how rows are returned: "dict" (default), "tuple" or "namedtuple".
+    """
+    if row_mode not in ROW_MODES:
+        raise ValueError(f"Unknown row_mode: {row_mode}")
     data = None
+    started = time.perf_counter() if metrics.METRICS_ENABLED else 0.0
     try:
-        with sqlite3.connect(DB_NAME) as conn:
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            cursor.execute(query, params)
-            
+        conn = _get_connection()
+        # The connection context manager commits on success and rolls back on error.
+        with conn:
+            cursor = conn.execute(query, params)
             if commit:
-                conn.commit()
-            elif fetch_one:
+                return None
+            if fetch_one:
                 result = cursor.fetchone()
-                data = dict(result) if result else None
+                data = _convert_rows(cursor, [result], row_mode)[0] if result else None
             else:
-                results = cursor.fetchall()
-                data = [dict(row) for row in results]
+                data = _convert_rows(cursor, cursor.fetchall(), row_mode)
     except sqlite3.Error as e:
-        print(f"Database error: {e}")
+        logger.error(f"Database error: {e}")
         # Depending on the application's needs, you might want to raise the exception
         # or return a default value like None or an empty list.
         return None if fetch_one or commit else []
-        
+    finally:
+        if metrics.METRICS_ENABLED:
+            metrics.DB_QUERY_SECONDS.observe(_query_label(query), time.perf_counter() - started)
+
     return data
 
 def get_college_info() -> Optional[Dict[str, Any]]:
     """Fetches general information about the college."""
     return _execute_query("SELECT * FROM college_info WHERE id = 1", fetch_one=True)
 
+def _trigrams(text: str, padded: bool = False) -> Set[str]:
+    """Word trigrams as indexed by FTS5; padded adds word-boundary grams (like pg_trgm) for scoring."""
+    grams = set()
+    for word in _WORD_RE.findall(text.lower()):
+        if padded:
+            word = f"  {word} "
+        grams.update(word[i:i + 3] for i in range(len(word) - 2))
+    return grams
+
+def _similarity(query_grams: Set[str], text: str) -> float:
+    """Share of all padded trigrams (Jaccard), so words on either side that the other lacks count against a match."""
+    text_grams = _trigrams(text, padded=True)
+    if not text_grams or not query_grams:
+        return 0.0
+    return len(query_grams & text_grams) / len(query_grams | text_grams)
+
+def search(table: str, term: str, limit: int = 5) -> List[Dict[str, Any]]:
+    """
+    Returns up to `limit` rows of `table` best matching `term`, most relevant first.
+    Tolerates typos and a missing or extra word; terms too short to index fall back to a substring scan.
+    """
+    if table not in SEARCH_INDEXES:
+        raise ValueError(f"No search index for table: {table}")
+    columns = SEARCH_INDEXES[table]
+    query_grams = _trigrams(term)
+    if not query_grams:
+        where = " OR ".join(f"{col} LIKE ?" for col in columns)
+        return _execute_query(f"SELECT * FROM {table} WHERE {where} LIMIT ?", (f"%{term}%",) * len(columns) + (limit,))
+
+    match = " OR ".join(f'"{gram}"' for gram in sorted(query_grams))
+    query = f"""
+        SELECT t.* FROM {table}_fts JOIN {table} t ON t.id = {table}_fts.rowid
+        WHERE {table}_fts MATCH ? ORDER BY bm25({table}_fts) LIMIT ?
+    """
+    candidates = _execute_query(query, (match, SEARCH_CANDIDATES))
+    query_grams = _trigrams(term, padded=True)
+    scored = []
+    for bm25_rank, row in enumerate(candidates):
+        score = max(_similarity(query_grams, str(row[col])) for col in columns)
+        if score >= MIN_SEARCH_SIMILARITY:
+            scored.append((-score, bm25_rank, row))
+    scored.sort(key=lambda item: item[:2])
+    return [row for _, _, row in scored[:limit]]
+
 def find_location(place_name: str) -> Optional[Dict[str, Any]]:
-    """Finds a location by name."""
-    query = "SELECT * FROM locations WHERE name LIKE ?"
-    results = _execute_query(query, (f"%{place_name}%",))
+    """Finds the best matching location by name."""
+    results = search("locations", place_name, limit=1)
     return results[0] if results else None
 
 def find_faculty(faculty_name: str) -> Optional[Dict[str, Any]]:
-    """Finds a faculty member by name."""
-    query = "SELECT * FROM faculty WHERE name LIKE ?"
-    results = _execute_query(query, (f"%{faculty_name}%",))
+    """Finds the best matching faculty member by name."""
+    results = search("faculty", faculty_name, limit=1)
     return results[0] if results else None
 
 def find_course(course_query: str) -> Optional[Dict[str, Any]]:
-    """Finds a course by its code or name."""
-    query = "SELECT * FROM courses WHERE code LIKE ? OR name LIKE ?"
-    params = (f"%{course_query}%", f"%{course_query}%")
-    results = _execute_query(query, params)
+    """Finds the best matching course by its code or name."""
+    results = search("courses", course_query, limit=1)
     return results[0] if results else None
 
 def get_upcoming_events() -> List[Dict[str, Any]]:
@@ -59,8 +200,13 @@ def get_upcoming_events() -> List[Dict[str, Any]]:
     query = "SELECT * FROM events WHERE date >= ? ORDER BY date ASC"
     return _execute_query(query, (today_str,))
 
-def get_all_data_for_prompt() -> Dict[str, Any]:
-    """Fetches all data from the DB to be used as context for the Gemini prompt."""
+def get_data_version() -> Optional[int]:
+    """Returns the current campus data version, or None if the version table is missing."""
+    result = _execute_query("SELECT version FROM campus_data_version WHERE id = 1", fetch_one=True, row_mode="tuple")
+    return result[0] if result else None
+
+def _load_snapshot() -> Dict[str, Any]:
+    """Fetches all campus tables from the DB."""
     return {
         "college_info": get_college_info(),
         "locations": _execute_query("SELECT * FROM locations"),
@@ -69,7 +215,55 @@ def get_all_data_for_prompt() -> Dict[str, Any]:
         "courses": _execute_query("SELECT * FROM courses"),
     }
 
+def get_all_data_for_prompt() -> Tuple[Dict[str, Any], Optional[int]]:
+    """
+    Returns all campus data to be used as context for the Gemini prompt, and the data version
+    it was loaded at (None if the version table is missing). The data is a shared snapshot
+    and must not be mutated by callers.
+    """
+    global _snapshot
+    version = get_data_version()
+    snapshot = _snapshot
+    if snapshot is not None and version is not None and version == snapshot[1]:
+        _snapshot_stats["hits"] += 1
+        return snapshot
+
+    with _snapshot_lock:
+        # Another thread may have rebuilt the snapshot while we waited for the lock.
+        snapshot = _snapshot
+        if snapshot is not None and version is not None and version == snapshot[1]:
+            _snapshot_stats["hits"] += 1
+            return snapshot
+        _snapshot_stats["misses"] += 1
+        _snapshot = snapshot = (_load_snapshot(), version)
+        _snapshot_stats["rebuilds"] += 1
+        return snapshot
+
+def invalidate_snapshot():
+    """Forces the next get_all_data_for_prompt call to reload from the DB."""
+    global _snapshot
+    with _snapshot_lock:
+        _snapshot = None
+
+def get_snapshot_stats() -> Dict[str, Any]:
+    """Returns hit/miss/rebuild counters for the campus snapshot."""
+    snapshot = _snapshot
+    return {**_snapshot_stats, "version": snapshot[1] if snapshot is not None else None}
+
 def save_feedback(session_id: str, rating: Optional[int], comment: Optional[str]):
     """Saves user feedback for a live chat session."""
     query = "INSERT INTO live_chat_feedback (session_id, rating, comment) VALUES (?, ?, ?)"
-    _execute_query(query, (session_id, rating, comment), commit=True)
\ No newline at end of file
+    _execute_query(query, (session_id, rating, comment), commit=True)
+
+def save_feedback_batch(rows: List[Tuple[str, Optional[int], Optional[str]]]):
+    """
+    Saves many (session_id, rating, comment) rows in one transaction.
+    Unlike the other helpers this raises sqlite3.Error, so callers can retry.
+    """
+    query = "INSERT INTO live_chat_feedback (session_id, rating, comment) VALUES (?, ?, ?)"
+    started = time.perf_counter()
+    conn = _get_connection()
+    with conn:
+        conn.executemany(query, rows)
+    if metrics.METRICS_ENABLED:
+        metrics.DB_QUERY_SECONDS.observe("insert_batch live_chat_feedback", time.perf_counter() - started)
\ No newline at end of file
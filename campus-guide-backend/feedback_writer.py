@@ -0,0 +1,213 @@
+# feedback_writer.py
+import os
+import json
+import time
+import queue
+import sqlite3
+import logging
+import threading
+from typing import Dict, Any, Optional, List, Tuple
+
+import database
+
+logger = logging.getLogger(__name__)
+
+# Buffer size, and the batch size / age at which buffered feedback is flushed
+FEEDBACK_QUEUE_SIZE = int(os.getenv("FEEDBACK_QUEUE_SIZE", "10000"))
+FEEDBACK_BATCH_SIZE = int(os.getenv("FEEDBACK_BATCH_SIZE", "200"))
+FEEDBACK_FLUSH_SECONDS = float(os.getenv("FEEDBACK_FLUSH_SECONDS", "0.5"))
+FEEDBACK_WRITE_RETRIES = 3
+# While rows are waiting for a retry, how often to retry them when no new feedback arrives
+FEEDBACK_RETRY_SECONDS = float(os.getenv("FEEDBACK_RETRY_SECONDS", "5"))
+# Rows still unwritten at shutdown, or piling up past the buffer size, are saved here and
+# written on the next start
+FEEDBACK_FALLBACK_PATH = os.getenv("FEEDBACK_FALLBACK_PATH", "feedback_pending.jsonl")
+
+FeedbackRow = Tuple[str, Optional[int], Optional[str]]
+
+_STOP = object()
+
+class FeedbackWriter:
+    """
+    Write-behind buffer for live-chat feedback.
+
+    submit() only enqueues; a background thread writes batches with executemany in a single
+    transaction once FEEDBACK_BATCH_SIZE rows are waiting or the oldest is FEEDBACK_FLUSH_SECONDS
+    old. When the buffer is full, or the writer isn't running, submit() writes synchronously
+    instead and raises if that fails. stop() drains everything still buffered.
+
+    A batch that still fails after FEEDBACK_WRITE_RETRIES attempts is kept and written together
+    with the next one. Rows still unwritten at stop(), or more than the buffer size of them, go to
+    FEEDBACK_FALLBACK_PATH and are retried from there on the next start(). Feedback is only lost
+    if that file can't be written either; those rows are counted as failed.
+    """
+
+    def __init__(self, max_queue: int = FEEDBACK_QUEUE_SIZE, batch_size: int = FEEDBACK_BATCH_SIZE,
+                 flush_seconds: float = FEEDBACK_FLUSH_SECONDS, retry_seconds: float = FEEDBACK_RETRY_SECONDS,
+                 fallback_path: str = FEEDBACK_FALLBACK_PATH):
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.retry_seconds = retry_seconds
+        self.fallback_path = fallback_path
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._thread: Optional[threading.Thread] = None
+        # Rows whose write failed, retried with the next batch; only the writer thread touches them
+        self._pending: List[FeedbackRow] = []
+        # Whether _pending holds rows loaded from the fallback file, which still has them
+        self._pending_from_file = False
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "submitted": 0, "written": 0, "flushes": 0, "sync_writes": 0, "saved_to_file": 0, "failed": 0,
+            "last_flush_ms": 0.0, "max_flush_ms": 0.0, "total_flush_ms": 0.0,
+        }
+
+    def start(self):
+        if self._thread is None:
+            self._load_fallback()
+            self._thread = threading.Thread(target=self._run, name="feedback-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """Flushes buffered feedback and stops the writer thread."""
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logger.error(f"Feedback writer did not stop within {timeout}s; {self._queue.qsize()} rows still buffered.")
+        self._thread = None
+
+    def submit(self, session_id: str, rating: Optional[int], comment: Optional[str]):
+        row = (session_id, rating, comment)
+        self._count("submitted")
+        if self._thread is not None:
+            try:
+                self._queue.put_nowait(row)
+                return
+            except queue.Full:
+                logger.warning("Feedback buffer full; writing synchronously.")
+        # Raises on failure so the caller can report it
+        database.save_feedback_batch([row])
+        self._count("sync_writes")
+        self._count("written")
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            try:
+                # With rows waiting for a retry, wake up for it even if no new feedback arrives
+                item = self._queue.get(timeout=self.retry_seconds if self._pending else None)
+            except queue.Empty:
+                self._flush([])
+                continue
+            if item is _STOP:
+                break
+            batch: List[FeedbackRow] = [item]
+            deadline = time.monotonic() + self.flush_seconds
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._flush(batch)
+
+        # Drain anything submitted after the stop request
+        leftovers = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                leftovers.append(item)
+        # One last attempt, together with any rows waiting for a retry; what fails is saved to file
+        self._flush(leftovers)
+        if self._pending:
+            self._save_fallback()
+
+    def _flush(self, batch: List[FeedbackRow]):
+        """Writes the rows waiting for a retry and batch in one transaction, or keeps them all for the next one."""
+        rows = self._pending + batch
+        if not rows:
+            return
+        started = time.perf_counter()
+        for attempt in range(FEEDBACK_WRITE_RETRIES):
+            try:
+                database.save_feedback_batch(rows)
+                break
+            except sqlite3.Error as e:
+                logger.warning(f"Feedback flush of {len(rows)} rows failed (attempt {attempt + 1}): {e}")
+                time.sleep(0.1 * 2 ** attempt)
+        else:
+            logger.error(f"Feedback flush failed {FEEDBACK_WRITE_RETRIES} times; keeping {len(rows)} rows to retry.")
+            self._pending = rows
+            if len(rows) >= self.max_queue:
+                self._save_fallback()
+            return
+
+        self._pending = []
+        if self._pending_from_file:
+            self._pending_from_file = False
+            try:
+                os.remove(self.fallback_path)
+            except OSError as e:
+                logger.error(f"Could not remove {self.fallback_path}; its feedback will be written again: {e}")
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._stats_lock:
+            self._stats["written"] += len(rows)
+            self._stats["flushes"] += 1
+            self._stats["last_flush_ms"] = round(elapsed_ms, 3)
+            self._stats["max_flush_ms"] = round(max(self._stats["max_flush_ms"], elapsed_ms), 3)
+            self._stats["total_flush_ms"] += elapsed_ms
+
+    def _save_fallback(self):
+        """Moves the rows waiting for a retry to the fallback file, for the next start() to write."""
+        rows, self._pending = self._pending, []
+        try:
+            # Rows loaded from the file are still in it, so rewrite it rather than append them twice
+            with open(self.fallback_path, "w" if self._pending_from_file else "a", encoding="utf-8") as f:
+                f.writelines(json.dumps(row) + "\n" for row in rows)
+        except OSError as e:
+            logger.error(f"Could not save {len(rows)} unwritten feedback rows to {self.fallback_path}: {e}")
+            self._count("failed", len(rows))
+        else:
+            logger.error(f"Saved {len(rows)} unwritten feedback rows to {self.fallback_path}; they are retried on the next start.")
+            self._count("saved_to_file", len(rows))
+        self._pending_from_file = False
+
+    def _load_fallback(self):
+        """Picks up rows a previous run saved to the fallback file; the first flush writes them."""
+        try:
+            with open(self.fallback_path, encoding="utf-8") as f:
+                rows = [tuple(json.loads(line)) for line in f if line.strip()]
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.error(f"Could not read unwritten feedback from {self.fallback_path}: {e}")
+            return
+        if rows:
+            logger.info(f"Retrying {len(rows)} feedback rows saved to {self.fallback_path} by a previous run.")
+            self._pending = rows + self._pending
+            self._pending_from_file = True
+
+    def _count(self, key: str, amount: int = 1):
+        with self._stats_lock:
+            self._stats[key] += amount
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Returns queue depth, rows waiting for a retry, row counters and flush latency."""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["queue_depth"] = self._queue.qsize()
+        stats["pending_retry"] = len(self._pending)
+        total_flush_ms = stats.pop("total_flush_ms")
+        stats["avg_flush_ms"] = round(total_flush_ms / stats["flushes"], 3) if stats["flushes"] else 0.0
+        return stats
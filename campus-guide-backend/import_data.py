@@ -0,0 +1,298 @@
+# import_data.py
+"""
+Bulk import of campus records from CSV or JSON Lines exports.
+
+    python import_data.py locations.csv faculty.jsonl courses.csv events.csv
+    python import_data.py --table locations rooms_export.csv --delete-missing
+
+The table comes from --table or the file name (locations.csv, faculty_2026.jsonl, ...). Files are
+streamed and validated row by row, and valid rows are upserted in batches on the table's natural
+key: locations and faculty by name, courses by code, events by name and date. Rows identical to
+what is stored are not rewritten, so re-importing a refreshed export only touches what changed.
+
+The whole run is one transaction. The search-index and version triggers are dropped for the
+load; afterwards the touched search indexes are rebuilt and the data version is bumped once.
+A running server sees either the old data or all of the new.
+"""
+import os
+import csv
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import setup_database
+
+BATCH_SIZE = 5000
+# Invalid rows are skipped and counted; only the first few are printed
+MAX_REPORTED_ERRORS = 20
+
+def _text(value: Any) -> str:
+    text = str(value).strip()
+    if not text:
+        raise ValueError("is empty")
+    return text
+
+def _credits(value: Any) -> int:
+    try:
+        credits = int(str(value).strip())
+    except ValueError:
+        raise ValueError(f"is not a whole number: {value!r}")
+    if not 0 <= credits <= 30:
+        raise ValueError(f"is out of range: {credits}")
+    return credits
+
+def _iso_date(value: Any) -> str:
+    text = _text(value)
+    try:
+        return datetime.date.fromisoformat(text).isoformat()
+    except ValueError:
+        raise ValueError(f"is not a YYYY-MM-DD date: {text!r}")
+
+# Per table: the upsert key and every column with its validator (all columns are NOT NULL)
+TABLES: Dict[str, Dict[str, Any]] = {
+    "locations": {"key": ("name",), "columns": {"name": _text, "details": _text}},
+    "faculty": {"key": ("name",), "columns": {"name": _text, "department": _text, "location": _text, "contact": _text}},
+    "courses": {"key": ("code",), "columns": {"code": _text, "name": _text, "department": _text, "instructor": _text,
+                                              "description": _text, "credits": _credits}},
+    "events": {"key": ("name", "date"), "columns": {"name": _text, "date": _iso_date, "venue": _text, "description": _text}},
+}
+
+def table_for(path: str) -> Optional[str]:
+    """Guesses the table from a file name such as locations.csv or faculty-2026.jsonl."""
+    stem = os.path.splitext(os.path.basename(path))[0].lower()
+    for table in TABLES:
+        if stem == table or stem.startswith((f"{table}_", f"{table}-", f"{table}.")):
+            return table
+    return None
+
+def read_records(path: str, columns: Tuple[str, ...] = ()) -> Iterator[Tuple[int, Any]]:
+    """
+    Yields (line number, record) from a CSV file with a header row, or a JSON Lines file.
+    A CSV header missing any of columns fails the whole file rather than every row.
+    """
+    if path.lower().endswith(".csv"):
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            reader = csv.DictReader(f)
+            missing = [column for column in columns if column not in (reader.fieldnames or ())]
+            if missing:
+                raise ValueError(f"{path}: header is missing {', '.join(missing)}")
+            for record in reader:
+                yield reader.line_num, record
+    elif path.lower().endswith((".jsonl", ".ndjson")):
+        with open(path, encoding="utf-8") as f:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    yield line_number, json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield line_number, e
+    else:
+        raise ValueError(f"{path}: expected a .csv, .jsonl or .ndjson file")
+
+def validate(table: str, record: Any) -> Tuple:
+    """Returns the row's values in column order, or raises ValueError saying what is wrong."""
+    if isinstance(record, json.JSONDecodeError):
+        raise ValueError(f"invalid JSON: {record.msg}")
+    if not isinstance(record, dict):
+        raise ValueError("is not an object")
+    values = []
+    for column, convert in TABLES[table]["columns"].items():
+        value = record.get(column)
+        if value is None:
+            raise ValueError(f"{column} is missing")
+        try:
+            values.append(convert(value))
+        except ValueError as e:
+            raise ValueError(f"{column} {e}")
+    return tuple(values)
+
+def _key_of(table: str, record: Any) -> Optional[Tuple]:
+    """The key of a rejected row, if its key columns are valid on their own; otherwise None."""
+    if not isinstance(record, dict):
+        return None
+    key = []
+    for column in TABLES[table]["key"]:
+        value = record.get(column)
+        if value is None:
+            return None
+        try:
+            key.append(TABLES[table]["columns"][column](value))
+        except ValueError:
+            return None
+    return tuple(key)
+
+def _upsert_sql(table: str) -> str:
+    """An upsert on the table's key that only writes rows whose values actually changed."""
+    key, columns = TABLES[table]["key"], list(TABLES[table]["columns"])
+    others = [column for column in columns if column not in key]
+    return (
+        f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)}) "
+        f"ON CONFLICT ({', '.join(key)}) DO UPDATE SET {', '.join(f'{c} = excluded.{c}' for c in others)} "
+        f"WHERE {' OR '.join(f'{c} IS NOT excluded.{c}' for c in others)}"
+    )
+
+def _count(cursor: sqlite3.Cursor, table: str) -> int:
+    return cursor.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+def _keys_table(table: str) -> str:
+    return f"temp.import_keys_{table}"
+
+def import_file(cursor: sqlite3.Cursor, path: str, table: str, batch_size: int = BATCH_SIZE,
+                strict: bool = False, track_keys: bool = False) -> Dict[str, Any]:
+    """
+    Upserts one file's valid rows into table. Call inside a transaction, with the search and
+    version triggers dropped. With track_keys, every key seen is also kept for delete_missing,
+    including those of rejected rows, so a bad row never deletes the record it was meant to update.
+    """
+    key = TABLES[table]["key"]
+    upsert = _upsert_sql(table)
+    if track_keys:
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {_keys_table(table)} ({', '.join(key)}, PRIMARY KEY ({', '.join(key)})) WITHOUT ROWID")
+        remember = f"INSERT OR IGNORE INTO {_keys_table(table)} VALUES ({', '.join('?' for _ in key)})"
+    stats = {"file": path, "table": table, "rows": 0, "rejected": 0, "unkeyed": 0, "inserted": 0, "updated": 0, "unchanged": 0}
+    rows_before = _count(cursor, table)
+    changed = 0
+    started = time.perf_counter()
+
+    def flush(batch: List[Tuple]):
+        nonlocal changed
+        # The key columns come first in every table's column order
+        cursor.executemany(upsert, batch)
+        changed += cursor.rowcount
+        if track_keys:
+            cursor.executemany(remember, (row[:len(key)] for row in batch))
+
+    batch: List[Tuple] = []
+    for line_number, record in read_records(path, tuple(TABLES[table]["columns"])):
+        stats["rows"] += 1
+        try:
+            batch.append(validate(table, record))
+        except ValueError as e:
+            if strict:
+                raise ValueError(f"{path}:{line_number}: {e}")
+            stats["rejected"] += 1
+            if stats["rejected"] <= MAX_REPORTED_ERRORS:
+                print(f"  ⚠️ {path}:{line_number}: {e}; skipped")
+            if track_keys:
+                rejected_key = _key_of(table, record)
+                if rejected_key is None:
+                    stats["unkeyed"] += 1
+                else:
+                    cursor.execute(remember, rejected_key)
+            continue
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = []
+    if batch:
+        flush(batch)
+
+    stats["inserted"] = _count(cursor, table) - rows_before
+    stats["updated"] = changed - stats["inserted"]
+    stats["unchanged"] = stats["rows"] - stats["rejected"] - changed
+    stats["seconds"] = time.perf_counter() - started
+    return stats
+
+def delete_missing(cursor: sqlite3.Cursor, table: str) -> int:
+    """Deletes the table's rows whose key wasn't in any imported file; returns how many."""
+    key = ", ".join(TABLES[table]["key"])
+    if cursor.execute(f"SELECT COUNT(*) FROM {_keys_table(table)}").fetchone()[0] == 0:
+        raise ValueError(f"refusing to delete every row of {table}: no rows with a valid key were imported")
+    cursor.execute(f"DELETE FROM {table} WHERE ({key}) NOT IN (SELECT {key} FROM {_keys_table(table)})")
+    return cursor.rowcount
+
+def run(paths: List[str], db_name: str = "campus.db", table: Optional[str] = None, batch_size: int = BATCH_SIZE,
+        strict: bool = False, prune: bool = False) -> List[Dict[str, Any]]:
+    """
+    Imports every file in one transaction and returns per-file stats. Nothing is written if any
+    file can't be read, or with strict=True, if any row is invalid.
+    """
+    jobs = []
+    for path in paths:
+        target = table or table_for(path)
+        if target not in TABLES:
+            raise ValueError(f"{path}: can't tell which table this is for; name the file after one of "
+                             f"{', '.join(TABLES)} or pass --table")
+        jobs.append((path, target))
+
+    conn = sqlite3.connect(db_name, isolation_level=None)  # transactions are managed explicitly below
+    cursor = conn.cursor()
+    try:
+        cursor.execute("PRAGMA busy_timeout = 5000")
+        cursor.execute("PRAGMA cache_size = -64000")  # in KiB
+        existing = {row[0] for row in cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        missing = {target for _, target in jobs} - existing
+        if missing:
+            raise ValueError(f"{db_name} has no {', '.join(sorted(missing))} table; run setup_database.py first")
+
+        # DDL is transactional in SQLite, so readers never see the triggers missing
+        cursor.execute("BEGIN IMMEDIATE")
+        if any(target == "events" for _, target in jobs):
+            # The events upsert conflicts on (name, date); databases set up before that key get it here,
+            # while the version trigger is still in place for any duplicates it deletes
+            setup_database.create_event_key_index(cursor)
+        setup_database.drop_search_triggers(cursor)
+        setup_database.drop_version_triggers(cursor)
+        results = [import_file(cursor, path, target, batch_size, strict, track_keys=prune) for path, target in jobs]
+
+        finishing = time.perf_counter()
+        changed_tables = {stats["table"] for stats in results if stats["inserted"] or stats["updated"]}
+        if prune:
+            for target in dict.fromkeys(target for _, target in jobs):
+                # A row too broken to tell which record it is for might be for any of them
+                unkeyed = sum(stats["unkeyed"] for stats in results if stats["table"] == target)
+                if unkeyed:
+                    raise ValueError(f"refusing to delete missing rows of {target}: {unkeyed} rejected rows have no valid key")
+                deleted = delete_missing(cursor, target)
+                print(f"  {target}: {deleted} rows not in the import deleted")
+                if deleted:
+                    changed_tables.add(target)
+        setup_database.rebuild_search_index(cursor, changed_tables)
+        setup_database.create_search_index(cursor)
+        setup_database.create_version_triggers(cursor)
+        if changed_tables:
+            cursor.execute("UPDATE campus_data_version SET version = version + 1 WHERE id = 1")
+        cursor.execute("COMMIT")
+        print(f"  Search indexes rebuilt and changes committed in {time.perf_counter() - finishing:.2f}s")
+        return results
+    except BaseException:
+        if conn.in_transaction:
+            cursor.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="+", help="CSV (with a header row) or JSON Lines files")
+    parser.add_argument("--db", default="campus.db")
+    parser.add_argument("--table", choices=sorted(TABLES), help="table for every file, instead of guessing from file names")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--strict", action="store_true", help="abort the whole import on the first invalid row")
+    parser.add_argument("--delete-missing", action="store_true",
+                        help="treat the files as complete exports and delete rows whose key isn't in them")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    try:
+        results = run(args.files, args.db, args.table, args.batch_size, args.strict, args.delete_missing)
+    except (OSError, ValueError, csv.Error, sqlite3.Error) as e:
+        print(f"❌ Import failed, nothing was changed: {e}")
+        return 1
+    elapsed = time.perf_counter() - started
+
+    for stats in results:
+        rate = stats["rows"] / stats["seconds"] if stats["seconds"] else 0
+        print(f"  {stats['file']} -> {stats['table']}: {stats['rows']} rows ({stats['inserted']} inserted, "
+              f"{stats['updated']} updated, {stats['unchanged']} unchanged, {stats['rejected']} rejected) "
+              f"in {stats['seconds']:.2f}s, {rate:,.0f} rows/s")
+    total = sum(stats["rows"] for stats in results)
+    print(f"✅ Imported {total} rows from {len(results)} files in {elapsed:.2f}s ({total / elapsed:,.0f} rows/s)")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
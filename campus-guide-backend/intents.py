@@ -0,0 +1,237 @@
+# intents.py
+import re
+import datetime
+import threading
+from typing import List, Dict, Any, Optional, Tuple
+
+import database
+
+# Pre-translated answer templates for every language in data.LANGUAGE_MAP.
+# Record details come from the DB as-is.
+TEMPLATES = {
+    "location": {
+        "en": "{name} is located here: {details}",
+        "hi": "{name} यहाँ स्थित है: {details}",
+        "mr": "{name} येथे आहे: {details}",
+        "es": "{name} se encuentra aquí: {details}",
+        "fr": "{name} se trouve ici : {details}",
+    },
+    "faculty": {
+        "en": "{name} ({department}) can be found at {location}. Contact: {contact}",
+        "hi": "{name} ({department}) {location} में मिलेंगे। संपर्क: {contact}",
+        "mr": "{name} ({department}) {location} येथे भेटतील. संपर्क: {contact}",
+        "es": "Puede encontrar a {name} ({department}) en {location}. Contacto: {contact}",
+        "fr": "Vous pouvez trouver {name} ({department}) à {location}. Contact : {contact}",
+    },
+    "course": {
+        "en": "{code} – {name} ({department}, {credits} credits) is taught by {instructor}. {description}",
+        "hi": "{code} – {name} ({department}, {credits} क्रेडिट) {instructor} द्वारा पढ़ाया जाता है। {description}",
+        "mr": "{code} – {name} ({department}, {credits} क्रेडिट्स) {instructor} शिकवतात. {description}",
+        "es": "{code} – {name} ({department}, {credits} créditos) lo imparte {instructor}. {description}",
+        "fr": "{code} – {name} ({department}, {credits} crédits) est enseigné par {instructor}. {description}",
+    },
+    "event": {
+        "en": "{name} is on {date} at {venue}. {description}",
+        "hi": "{name} {date} को {venue} में है। {description}",
+        "mr": "{name} {date} रोजी {venue} येथे आहे. {description}",
+        "es": "{name} es el {date} en {venue}. {description}",
+        "fr": "{name} a lieu le {date} à {venue}. {description}",
+    },
+    "upcoming_events": {
+        "en": "Upcoming events:",
+        "hi": "आगामी कार्यक्रम:",
+        "mr": "आगामी कार्यक्रम:",
+        "es": "Próximos eventos:",
+        "fr": "Événements à venir :",
+    },
+    "upcoming_event_line": {
+        "en": "- {name}: {date}, {venue}",
+        "hi": "- {name}: {date}, {venue}",
+        "mr": "- {name}: {date}, {venue}",
+        "es": "- {name}: {date}, {venue}",
+        "fr": "- {name} : {date}, {venue}",
+    },
+    "more_upcoming_events": {
+        "en": "…and {count} more.",
+        "hi": "…और {count} अन्य।",
+        "mr": "…आणि आणखी {count}.",
+        "es": "…y {count} más.",
+        "fr": "…et {count} de plus.",
+    },
+    "no_upcoming_events": {
+        "en": "There are no upcoming events scheduled right now.",
+        "hi": "अभी कोई आगामी कार्यक्रम निर्धारित नहीं है।",
+        "mr": "सध्या कोणतेही आगामी कार्यक्रम नियोजित नाहीत.",
+        "es": "No hay próximos eventos programados por ahora.",
+        "fr": "Aucun événement à venir n'est prévu pour le moment.",
+    },
+}
+
+# Events listed in an "upcoming events" answer; the rest are summarized as "…and N more."
+MAX_UPCOMING_EVENTS = 8
+
+# Phrases that signal what kind of answer the user wants
+LOCATION_RE = re.compile(r"\b(?:where is|where's|location of|find the|how do i get to|how to reach|way to|directions to)\b")
+FACULTY_RE = re.compile(r"\b(?:who is|contact|email|office|cabin|meet|where is|where's|find)\b")
+COURSE_RE = re.compile(r"\b(?:course|subject|credits?|teach(?:es|ing)?|instructor|syllabus|about)\b")
+EVENT_RE = re.compile(r"\b(?:events?|fest|festival|happening|upcoming|when is|when's|when|date|venue)\b")
+UPCOMING_RE = re.compile(r"\b(?:upcoming|events|what's happening|whats happening|what is happening)\b")
+LOCATION_SPLIT_RE = re.compile(r"\b(?:where is|where's|location of|find the|how do i get to|how to reach|way to|directions to)\b")
+
+# Words around a place name that aren't part of it: "where is the library located"
+PLACE_FILLER_WORDS = frozenset({"the", "a", "an", "is", "located", "situated", "please", "on", "at", "campus", "college"})
+
+_NON_WORD_RE = re.compile(r"[^\w]+")
+_TITLE_RE = re.compile(r"^(?:dr|prof|mr|mrs|ms)\s+")
+_TRAILING_YEAR_RE = re.compile(r"\s+\d{4}$")
+
+_engine = None
+_engine_lock = threading.Lock()
+
+def _normalize(text: str) -> str:
+    return _NON_WORD_RE.sub(" ", text.lower()).strip()
+
+class _EntityMatcher:
+    """
+    Finds every entity name (and alias) of a campus snapshot in a normalized query. Aliases are
+    looked up by the words they start with, so a query costs a few dict probes per word however
+    large the catalog is.
+    """
+
+    def __init__(self, campus_data: Dict[str, Any]):
+        self.source = campus_data
+        self.entities: Dict[str, Tuple[str, Dict[str, Any]]] = {}  # normalized alias -> (kind, record)
+        for record in campus_data.get("locations") or []:
+            self._add("location", record, record["name"])
+        for record in campus_data.get("faculty") or []:
+            name = _normalize(record["name"])
+            self._add("faculty", record, name)
+            # "Mehta" and "dr mehta" should both find "Dr. Mehta"
+            self._add("faculty", record, _TITLE_RE.sub("", name))
+        for record in campus_data.get("courses") or []:
+            self._add("course", record, record["code"])
+            self._add("course", record, record["name"])
+        for record in campus_data.get("events") or []:
+            self._add("event", record, record["name"])
+            self._add("event", record, _TRAILING_YEAR_RE.sub("", _normalize(record["name"])))
+
+        # First word of an alias -> word counts of the aliases starting with it, longest first
+        lengths: Dict[str, set] = {}
+        for alias in self.entities:
+            words = alias.split(" ")
+            lengths.setdefault(words[0], set()).add(len(words))
+        self.lengths = {word: sorted(counts, reverse=True) for word, counts in lengths.items()}
+
+    def _add(self, kind: str, record: Dict[str, Any], alias: str):
+        alias = _normalize(alias)
+        # Very short aliases would match ordinary words
+        if len(alias) >= 3:
+            self.entities.setdefault(alias, (kind, record))
+
+    def find(self, normalized_query: str) -> List[Tuple[str, Dict[str, Any]]]:
+        """Whole-word alias matches from left to right, preferring the longest at each word."""
+        words = normalized_query.split(" ")
+        found = []
+        i = 0
+        while i < len(words):
+            for count in self.lengths.get(words[i], ()):
+                entity = self.entities.get(" ".join(words[i:i + count])) if i + count <= len(words) else None
+                if entity is not None:
+                    found.append(entity)
+                    i += count
+                    break
+            else:
+                i += 1
+        return found
+
+def _get_matcher(campus_data: Dict[str, Any]) -> _EntityMatcher:
+    """Returns the matcher for this snapshot, rebuilding it when database hands out a new one."""
+    global _engine
+    engine = _engine
+    if engine is None or engine.source is not campus_data:
+        with _engine_lock:
+            if _engine is None or _engine.source is not campus_data:
+                _engine = _EntityMatcher(campus_data)
+            engine = _engine
+    return engine
+
+def warm_up(campus_data: Dict[str, Any]):
+    """Builds the entity matcher for this snapshot ahead of the first request."""
+    _get_matcher(campus_data)
+
+def _place_words(query: str) -> List[str]:
+    """Words naming the place a location question asks about: what follows the last location phrase, minus filler."""
+    return [word for word in LOCATION_SPLIT_RE.split(query)[-1].split() if word not in PLACE_FILLER_WORDS]
+
+def _edit_distance(a: str, b: str) -> int:
+    """Levenshtein distance, counting a swap of adjacent letters as one edit."""
+    previous, current = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        before, previous, current = previous, current, [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (a[i - 1] != b[j - 1]))
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], before[j - 2] + 1)
+    return current[len(b)]
+
+def _word_matches(word: str, name_word: str) -> bool:
+    """Same word, an abbreviation of it ("comp" for "computer") or a typo of it ("librray")."""
+    if word == name_word or (len(word) >= 3 and name_word.startswith(word)):
+        return True
+    allowed = 2 if len(word) >= 8 else 1 if len(word) >= 4 else 0
+    return allowed > 0 and abs(len(word) - len(name_word)) <= allowed and _edit_distance(word, name_word) <= allowed
+
+def _names_place(name: str, place_words: List[str]) -> bool:
+    """Whether every word of the asked-for place matches a word of the location's name."""
+    name_words = _normalize(name).split()
+    return bool(place_words) and all(any(_word_matches(word, name_word) for name_word in name_words) for word in place_words)
+
+def _render(key: str, lang: str, **fields) -> str:
+    templates = TEMPLATES[key]
+    return templates.get(lang, templates["en"]).format(**fields)
+
+def _upcoming_events(campus_data: Dict[str, Any], lang: str) -> str:
+    today = datetime.date.today().isoformat()
+    events = sorted((e for e in campus_data.get("events") or [] if e["date"] >= today), key=lambda e: e["date"])
+    if not events:
+        return _render("no_upcoming_events", lang)
+    lines = [_render("upcoming_events", lang)]
+    lines += [_render("upcoming_event_line", lang, **event) for event in events[:MAX_UPCOMING_EVENTS]]
+    if len(events) > MAX_UPCOMING_EVENTS:
+        lines.append(_render("more_upcoming_events", lang, count=len(events) - MAX_UPCOMING_EVENTS))
+    return "\n".join(lines)
+
+def answer(user_query: str, target_lang: str, campus_data: Dict[str, Any]) -> Optional[Dict[str, Optional[str]]]:
+    """
+    Answers location, faculty, course and event questions from templates, without Gemini.
+    Returns None when no intent matches. May query the search index, so call it off the event loop.
+    """
+    query = _normalize(user_query)
+    college_info = campus_data.get("college_info") or {}
+    map_url = college_info.get("map_url")
+
+    # The location template only answers for the place being asked about, not any place mentioned:
+    # "find the library card renewal form" isn't asking for the Library
+    place_words = _place_words(query) if LOCATION_RE.search(query) else None
+    for kind, record in _get_matcher(campus_data).find(query):
+        if kind == "location" and place_words is not None and _names_place(record["name"], place_words):
+            return {"responseText": _render("location", target_lang, **record), "mapUrl": map_url}
+        if kind == "faculty" and FACULTY_RE.search(query):
+            return {"responseText": _render("faculty", target_lang, **record), "mapUrl": None}
+        if kind == "course" and (COURSE_RE.search(query) or query == _normalize(record["code"])):
+            return {"responseText": _render("course", target_lang, **record), "mapUrl": None}
+        if kind == "event" and EVENT_RE.search(query):
+            return {"responseText": _render("event", target_lang, **record), "mapUrl": None}
+
+    if UPCOMING_RE.search(query):
+        return {"responseText": _upcoming_events(campus_data, target_lang), "mapUrl": None}
+
+    if place_words is not None:
+        # No exact name in the query; try the typo-tolerant search index. Its best match is only
+        # answered from when it accounts for every word of the place asked about; "admission office"
+        # finding Admin Office, or "mechanical workshop" Mechanical Lab, is left to Gemini.
+        location = database.find_location(" ".join(place_words)) if place_words else None
+        if location and _names_place(location["name"], place_words):
+            return {"responseText": _render("location", target_lang, **location), "mapUrl": map_url}
+
+    return None
@@ -0,0 +1,395 @@
+# livechat.py
+from fastapi import WebSocket, WebSocketDisconnect, status
+from typing import Dict, Set, Optional, Tuple, Deque
+from collections import deque
+import os
+import time
+import asyncio
+import logging
+
+from livechat_backend import AGENTS, create_backend
+
+logger = logging.getLogger(__name__)
+
+# Messages buffered per client before it is treated as stalled and disconnected
+OUTBOUND_QUEUE_SIZE = int(os.getenv("LIVECHAT_OUTBOUND_QUEUE_SIZE", "256"))
+# Agents get queue_add/queue_remove deltas; a full queue_update is sent on connect, on request
+# (queue_sync, e.g. after a sequence gap) and at this interval as a safety net.
+QUEUE_RESYNC_SECONDS = float(os.getenv("LIVECHAT_QUEUE_RESYNC_SECONDS", "30"))
+# Waiting users are paired with agents as soon as one has room (LIVECHAT_AGENT_CAPACITY chats
+# by default); set to 0 to leave every pairing to accept_chat.
+AUTO_ASSIGN = os.getenv("LIVECHAT_AUTO_ASSIGN", "1") == "1"
+# Queue position/ETA updates go to waiting users at most this often, and only when they change
+QUEUE_POSITION_SECONDS = float(os.getenv("LIVECHAT_QUEUE_POSITION_SECONDS", "1"))
+# Recent assignments the ETA's drain rate is estimated from
+ETA_WINDOW = 20
+
+class ClientConnection:
+    """
+    A client's socket plus a bounded outbound queue drained by its own writer task,
+    so a slow socket only ever delays its own messages.
+    """
+
+    def __init__(self, websocket: WebSocket, client_id: str, on_failure):
+        self.websocket = websocket
+        self.client_id = client_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=OUTBOUND_QUEUE_SIZE)
+        self._on_failure = on_failure
+        self.closing = False
+        self._writer = asyncio.create_task(self._write())
+
+    def send(self, data: dict) -> bool:
+        """Queues a message without blocking; returns False if the buffer is full."""
+        if self.closing:
+            return True
+        try:
+            self.queue.put_nowait(data)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def _write(self):
+        while True:
+            data = await self.queue.get()
+            try:
+                await self.websocket.send_json(data)
+            except (WebSocketDisconnect, RuntimeError):
+                self.closing = True
+                self._on_failure(self)
+                return
+
+    async def close(self, code: int = status.WS_1000_NORMAL_CLOSURE):
+        self.closing = True
+        self._writer.cancel()
+        try:
+            if self.websocket.client_state.name == 'CONNECTED':
+                await self.websocket.close(code=code)
+        except RuntimeError:
+            pass
+
+# --- Connection Manager for WebSockets (Production Version) ---
+class ConnectionManager:
+    """
+    Pairs users with agents over WebSockets.
+
+    Sockets live in the worker that accepted them; queue and chat state live in the backend,
+    so with a shared backend a user and agent on different workers (or hosts) can still pair.
+    Messages for clients that aren't connected here are published through the backend.
+
+    The lock only guards state changes. Sends never happen under it: local messages go
+    onto the recipient's outbound queue and remote ones onto the publish queue.
+
+    Queue changes reach agents as numbered deltas ({"type": "queue_add" | "queue_remove",
+    "user_id", "seq"}), so fan-out cost doesn't grow with the queue length.
+
+    With AUTO_ASSIGN, whenever a user joins the queue or an agent gains room the backend pairs
+    the longest-waiting user with the least-loaded agent (assign_next), so agents no longer race
+    to accept the same user; accept_chat still works for picking someone by hand. A user who
+    arrives while an agent has room is paired without entering the queue (claim_agent). Waiting
+    users get {"type": "queue_position", "position", "eta_seconds"}.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend or create_backend()
+        self.connections: Dict[str, ClientConnection] = {}  # clients connected to this worker
+        self.agents: Set[str] = set()  # agents connected to this worker
+        self._lock = asyncio.Lock()
+        self._outbox: asyncio.Queue = asyncio.Queue(maxsize=OUTBOUND_QUEUE_SIZE * 16)
+        self._publisher: Optional[asyncio.Task] = None
+        self._resync: Optional[asyncio.Task] = None
+        self._background: Set[asyncio.Task] = set()
+        self._position_timer: Optional[asyncio.TimerHandle] = None
+        self._positions: Dict[str, Tuple[int, Optional[int]]] = {}  # last position/ETA sent to each waiting user
+        self._assigned_at: Deque[float] = deque(maxlen=ETA_WINDOW)  # when recent chats started
+        self._time_to_agent_total = 0.0
+        self.stats = {"messages_relayed": 0, "slow_client_disconnects": 0, "publish_drops": 0,
+                      "assignments_auto": 0, "assignments_manual": 0, "max_time_to_agent_seconds": 0.0}
+
+    async def start(self):
+        await self.backend.start(self._deliver_remote)
+        self._publisher = asyncio.create_task(self._publish_outbox())
+        self._resync = asyncio.create_task(self._resync_periodically())
+
+    async def stop(self):
+        for task in (self._publisher, self._resync):
+            if task:
+                task.cancel()
+        if self._position_timer:
+            self._position_timer.cancel()
+        await self.backend.stop()
+
+    async def connect(self, websocket: WebSocket, client_id: str, client_type: str, max_chats: Optional[int] = None):
+        """Accepts the socket; an agent may give its chat capacity up front so it applies before any assignment."""
+        await websocket.accept()
+        async with self._lock:
+            if client_id in self.connections:
+                logger.warning(f"Client {client_id} already connected. Closing old connection.")
+                await self._disconnect_client(client_id, code=status.WS_1001_GOING_AWAY)
+
+            self.connections[client_id] = ClientConnection(websocket, client_id, self._on_send_failure)
+
+            if client_type == "agent":
+                self.agents.add(client_id)
+                if max_chats is not None:
+                    await self.backend.set_capacity(client_id, max(max_chats, 0))
+                await self.backend.add_agent(client_id)
+                logger.info(f"✅ Agent connected: {client_id}")
+                await self.send_queue_snapshot(client_id)
+                await self._assign_pending()
+            else:
+                logger.info(f"✅ User connected: {client_id}")
+
+    async def disconnect(self, client_id: str, websocket: Optional[WebSocket] = None):
+        """Disconnects the client; if websocket is given, only while it is still the client's current socket."""
+        async with self._lock:
+            connection = self.connections.get(client_id)
+            if websocket is not None and connection is not None and connection.websocket is not websocket:
+                return
+            await self._disconnect_client(client_id)
+            await self._assign_pending()
+
+    async def _disconnect_client(self, client_id: str, code: int = status.WS_1000_NORMAL_CLOSURE):
+        connection = self.connections.pop(client_id, None)
+        if connection:
+            # Closing a stalled socket can take a while; don't hold the lock for it.
+            self._spawn(connection.close(code))
+            logger.info(f"🔌 Client disconnected: {client_id}")
+
+        if client_id in self.agents:
+            self.agents.discard(client_id)
+            await self.backend.remove_agent(client_id)
+            for user_in_chat in await self.backend.get_users_for(client_id):
+                await self._end_chat(user_in_chat, notify_agent=False)
+
+        dequeued = await self.backend.dequeue(client_id)
+        if dequeued is not None:
+            self._broadcast_queue_change("queue_remove", client_id, dequeued[0])
+        await self._end_chat(client_id, notify_user=False)
+
+    def _on_send_failure(self, connection: ClientConnection):
+        self._spawn(self.disconnect(connection.client_id, connection.websocket))
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def add_to_wait_queue(self, user_id: str):
+        async with self._lock:
+            if user_id not in self.connections or await self.backend.get_agent_for(user_id) is not None:
+                return
+            if AUTO_ASSIGN:
+                # With nobody waiting and an agent free, pair straight away; agents never see a queue change
+                agent_id = await self.backend.claim_agent(user_id)
+                if agent_id is not None:
+                    self._chat_started(user_id, agent_id, time.time(), None, auto=True)
+                    return
+            seq = await self.backend.enqueue(user_id)
+            if seq is not None:
+                logger.info(f"User {user_id} added to wait queue.")
+                self._broadcast_queue_change("queue_add", user_id, seq)
+                await self._assign_pending()
+
+    async def accept_chat(self, agent_id: str, user_id: str):
+        async with self._lock:
+            if agent_id not in self.agents:
+                return
+            # Dequeue is the claim: if another agent (possibly on another worker) got there first, stop.
+            dequeued = await self.backend.dequeue(user_id)
+            if dequeued is None:
+                return
+            seq, enqueued_at = dequeued
+            # This is the crucial line that enables User -> Agent messages
+            await self.backend.start_chat(user_id, agent_id)
+            self._chat_started(user_id, agent_id, enqueued_at, seq, auto=False)
+
+    async def set_capacity(self, agent_id: str, max_chats: int):
+        """Sets how many chats the agent is auto-assigned at once; 0 pauses assignment."""
+        async with self._lock:
+            if agent_id not in self.agents:
+                return
+            await self.backend.set_capacity(agent_id, max(max_chats, 0))
+            await self._assign_pending()
+
+    async def _assign_pending(self):
+        """Pairs waiting users with agents that have room until either runs out. Call under the lock."""
+        if not AUTO_ASSIGN:
+            return
+        while True:
+            assignment = await self.backend.assign_next()
+            if assignment is None:
+                return
+            user_id, agent_id, enqueued_at, seq = assignment
+            self._chat_started(user_id, agent_id, enqueued_at, seq, auto=True)
+
+    def _chat_started(self, user_id: str, agent_id: str, enqueued_at: float, seq: Optional[int], auto: bool):
+        """Notifies both sides and records the wait; seq is None if the user never entered the queue."""
+        self.send_json(user_id, {"type": "chat_started"})
+        self.send_json(agent_id, {"type": "chat_accepted", "user_id": user_id, "auto": auto})
+        if seq is not None:
+            self._broadcast_queue_change("queue_remove", user_id, seq)
+
+        time_to_agent = max(time.time() - enqueued_at, 0.0)
+        self.stats["assignments_auto" if auto else "assignments_manual"] += 1
+        self.stats["max_time_to_agent_seconds"] = max(self.stats["max_time_to_agent_seconds"], round(time_to_agent, 3))
+        self._time_to_agent_total += time_to_agent
+        self._assigned_at.append(time.monotonic())
+        logger.info(f"Chat started: user={user_id} <-> agent={agent_id} after {time_to_agent:.1f}s ({'auto' if auto else 'manual'})")
+
+    async def end_chat_by_agent(self, user_id: str):
+        async with self._lock:
+            await self._end_chat(user_id)
+            await self._assign_pending()
+
+    async def _end_chat(self, user_id: str, notify_user: bool = True, notify_agent: bool = True):
+        agent_id = await self.backend.end_chat(user_id)
+        if agent_id is None:
+            return
+        logger.info(f"Chat ended: user={user_id} <-> agent={agent_id}")
+
+        if notify_user:
+            self.send_json(user_id, {"type": "chat_ended"})
+        if notify_agent:
+            self.send_json(agent_id, {"type": "chat_ended_confirmation", "user_id": user_id})
+
+    async def relay_message(self, sender_id: str, message_data: dict):
+        # Relaying only reads the pairing, so it doesn't take the lock at all.
+        content = message_data.get("content")
+        if not content: return
+
+        # Agent -> User Path
+        if sender_id in self.agents:
+            user_id = message_data.get("user_id")
+            if user_id and await self.backend.get_agent_for(user_id) == sender_id:
+                logger.debug(f"MSG RELAY: Agent {sender_id} -> User {user_id}")
+                self.send_json(user_id, {"type": "message", "content": content})
+                self.stats["messages_relayed"] += 1
+            else:
+                logger.warning(f"MSG DENIED: Agent {sender_id} tried to message un-paired user {user_id}")
+
+        # User -> Agent Path
+        else:
+            agent_id = await self.backend.get_agent_for(sender_id)
+            if agent_id:
+                logger.debug(f"MSG RELAY: User {sender_id} -> Agent {agent_id}")
+                self.send_json(agent_id, {"type": "message", "user_id": sender_id, "content": content})
+                self.stats["messages_relayed"] += 1
+
+    def _broadcast_queue_change(self, change: str, user_id: str, seq: int):
+        message = {"type": change, "user_id": user_id, "seq": seq}
+        for agent_id in list(self.agents):
+            self._send_local(agent_id, message)
+        self._publish({"to": AGENTS, "data": message})
+        self._schedule_positions()
+
+    # --- Queue position and ETA for waiting users ---
+
+    def _schedule_positions(self):
+        """Sends position updates once QUEUE_POSITION_SECONDS after the first of a burst of queue changes."""
+        if self._position_timer is None and len(self.connections) > len(self.agents):
+            self._position_timer = asyncio.get_running_loop().call_later(
+                QUEUE_POSITION_SECONDS, lambda: self._spawn(self._send_positions()))
+
+    def _seconds_per_assignment(self) -> Optional[float]:
+        """How often chats have been starting lately (as seen by this worker), or None before the first."""
+        if not self._assigned_at:
+            return None
+        return (time.monotonic() - self._assigned_at[0]) / len(self._assigned_at)
+
+    async def _send_positions(self):
+        self._position_timer = None
+        try:
+            _, queue_list = await self.backend.get_queue()
+        except Exception as e:
+            logger.error(f"Error reading wait queue for position updates: {e!r}")
+            return
+        per_assignment = self._seconds_per_assignment()
+        positions = {}
+        for position, user_id in enumerate(queue_list, 1):
+            if user_id not in self.connections:
+                continue
+            eta = round(position * per_assignment) if per_assignment is not None else None
+            positions[user_id] = (position, eta)
+            if self._positions.get(user_id) != positions[user_id]:
+                self._send_local(user_id, {"type": "queue_position", "position": position, "eta_seconds": eta})
+        self._positions = positions
+
+    async def send_queue_snapshot(self, agent_id: str):
+        """Sends the full wait queue to one local agent, e.g. on connect or after it saw a sequence gap."""
+        seq, queue_list = await self.backend.get_queue()
+        self._send_local(agent_id, {"type": "queue_update", "queue": queue_list, "seq": seq})
+
+    async def broadcast_queue_to_agents(self):
+        """Sends the full wait queue to every agent connected to this worker."""
+        seq, queue_list = await self.backend.get_queue()
+        message = {"type": "queue_update", "queue": queue_list, "seq": seq}
+        for agent_id in list(self.agents):
+            self._send_local(agent_id, message)
+
+    async def get_stats(self) -> Dict[str, int]:
+        """Connection, buffer and assignment gauges for this worker, plus the backend's queue and chat counts."""
+        connections = list(self.connections.values())
+        assignments = self.stats["assignments_auto"] + self.stats["assignments_manual"]
+        return {
+            **self.stats,
+            "mean_time_to_agent_seconds": round(self._time_to_agent_total / assignments, 3) if assignments else None,
+            "connections": len(connections),
+            "agents": len(self.agents),
+            "users": len(connections) - len(self.agents),
+            "outbound_queued": sum(connection.queue.qsize() for connection in connections),
+            "publish_queued": self._outbox.qsize(),
+            **await self.backend.get_stats(),
+        }
+
+    async def _resync_periodically(self):
+        while True:
+            await asyncio.sleep(QUEUE_RESYNC_SECONDS)
+            try:
+                await self.broadcast_queue_to_agents()
+                # Catches room freed up by a worker that went away mid-change
+                async with self._lock:
+                    await self._assign_pending()
+            except Exception as e:
+                logger.error(f"Error resyncing wait queue: {e!r}")
+
+    def send_json(self, client_id: str, data: dict):
+        """Queues a message for the client, wherever it is connected. Never blocks."""
+        if client_id in self.connections:
+            self._send_local(client_id, data)
+        else:
+            # The client may be connected to another worker
+            self._publish({"to": client_id, "data": data})
+
+    def _send_local(self, client_id: str, data: dict):
+        connection = self.connections.get(client_id)
+        if connection and not connection.send(data):
+            logger.warning(f"Outbound buffer full for {client_id}; disconnecting slow client.")
+            self.stats["slow_client_disconnects"] += 1
+            connection.closing = True
+            self._on_send_failure(connection)
+
+    def _publish(self, envelope: dict):
+        try:
+            self._outbox.put_nowait(envelope)
+        except asyncio.QueueFull:
+            logger.error(f"Live chat publish queue full; dropping message for {envelope.get('to')}")
+            self.stats["publish_drops"] += 1
+
+    async def _publish_outbox(self):
+        while True:
+            envelope = await self._outbox.get()
+            try:
+                await self.backend.publish(envelope)
+            except Exception as e:
+                logger.error(f"Error publishing live chat event: {e!r}")
+
+    async def _deliver_remote(self, envelope: dict):
+        """Delivers a message published by another worker to the matching local sockets."""
+        recipient, data = envelope.get("to"), envelope.get("data")
+        if recipient == AGENTS:
+            for agent_id in list(self.agents):
+                self._send_local(agent_id, data)
+            # Another worker changed the queue, which moves the users waiting here too
+            self._schedule_positions()
+        elif recipient in self.connections:
+            self._send_local(recipient, data)
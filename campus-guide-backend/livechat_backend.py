@@ -0,0 +1,403 @@
+# livechat_backend.py
+import os
+import json
+import time
+import uuid
+import heapq
+import asyncio
+import logging
+from typing import List, Dict, Optional, Set, Callable, Awaitable, Union, Tuple
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # Only needed when running several workers
+    aioredis = None
+
+logger = logging.getLogger(__name__)
+
+# Set to e.g. redis://localhost:6379/0 to share live-chat state between workers and hosts
+LIVECHAT_REDIS_URL = os.getenv("LIVECHAT_REDIS_URL")
+# Chats an agent is given at once unless it sets its own limit (set_capacity)
+LIVECHAT_AGENT_CAPACITY = int(os.getenv("LIVECHAT_AGENT_CAPACITY", "3"))
+
+MessageHandler = Callable[[dict], Awaitable[None]]
+
+# Envelope recipient meaning "every agent connected to the receiving worker"
+AGENTS = "@agents"
+
+# (user_id, agent_id, enqueued_at, queue seq) of a chat started by assign_next
+Assignment = Tuple[str, str, float, int]
+
+class LocalBackend:
+    """
+    In-process live-chat state. Suitable for a single uvicorn worker.
+
+    Every backend holds the shared state (agents, wait queue, active chats) and relays
+    envelopes ({"to": client_id or AGENTS, "data": {...}}) to the other workers, whose
+    ConnectionManager delivers them to the sockets it holds. RedisBackend implements
+    the same methods.
+
+    assign_next pairs the longest-waiting user with the least-loaded agent that has room,
+    using two heaps with lazy deletion: entries are checked against the current state when
+    they reach the top, and stale ones are dropped.
+    """
+
+    def __init__(self):
+        self.agents: Set[str] = set()
+        self.wait_queue: Dict[str, float] = {}  # {user_id: enqueued_at}, insertion-ordered
+        self.queue_seq = 0  # bumped on every wait-queue change
+        self.active_chats: Dict[str, str] = {}  # {user_id: agent_id}
+        self.agent_chats: Dict[str, Set[str]] = {}  # {agent_id: {user_id, ...}}, reverse of active_chats
+        self.capacity: Dict[str, int] = {}  # {agent_id: max concurrent chats}, when set by the agent
+        self.last_assigned: Dict[str, float] = {}  # {agent_id: time of its last chat}
+        self._user_heap: List[Tuple[float, str]] = []  # (enqueued_at, user_id)
+        self._agent_heap: List[Tuple[int, float, str]] = []  # (load, last_assigned, agent_id), agents with room only
+
+    async def start(self, on_message: MessageHandler):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def publish(self, envelope: dict):
+        # There are no other workers to deliver to.
+        pass
+
+    async def add_agent(self, agent_id: str):
+        self.agents.add(agent_id)
+        self._push_agent(agent_id)
+
+    async def remove_agent(self, agent_id: str):
+        # Its heap entries go stale and are dropped when they surface
+        self.agents.discard(agent_id)
+
+    async def set_capacity(self, agent_id: str, max_chats: int):
+        self.capacity[agent_id] = max_chats
+        self._push_agent(agent_id)
+
+    async def enqueue(self, user_id: str) -> Optional[int]:
+        """Adds the user to the wait queue and returns the new queue sequence number, or None if already queued."""
+        if user_id in self.wait_queue:
+            return None
+        enqueued_at = self.wait_queue[user_id] = time.time()
+        heapq.heappush(self._user_heap, (enqueued_at, user_id))
+        self.queue_seq += 1
+        return self.queue_seq
+
+    async def dequeue(self, user_id: str) -> Optional[Tuple[int, float]]:
+        """
+        Removes the user from the wait queue and returns the new sequence number and when they
+        were enqueued, or None if they weren't queued. Only one caller gets a result for a given enqueue.
+        """
+        enqueued_at = self.wait_queue.pop(user_id, None)
+        if enqueued_at is None:
+            return None
+        self.queue_seq += 1
+        return self.queue_seq, enqueued_at
+
+    async def assign_next(self) -> Optional[Assignment]:
+        """
+        Starts a chat between the longest-waiting user and the least-loaded agent with room
+        (ties go to the agent idle longest), or returns None if either is missing.
+        """
+        user_heap, agent_heap = self._user_heap, self._agent_heap
+        while user_heap and self.wait_queue.get(user_heap[0][1]) != user_heap[0][0]:
+            heapq.heappop(user_heap)
+        while agent_heap and not self._is_current(*agent_heap[0]):
+            heapq.heappop(agent_heap)
+        if not user_heap or not agent_heap:
+            return None
+        enqueued_at, user_id = heapq.heappop(user_heap)
+        agent_id = heapq.heappop(agent_heap)[2]
+        del self.wait_queue[user_id]
+        self.queue_seq += 1
+        await self.start_chat(user_id, agent_id)
+        self._compact()
+        return user_id, agent_id, enqueued_at, self.queue_seq
+
+    async def claim_agent(self, user_id: str) -> Optional[str]:
+        """
+        Starts a chat between the user and the least-loaded agent with room, without queueing,
+        and returns the agent; None if anyone is already waiting, the user is in a chat, or no agent has room.
+        """
+        if self.wait_queue or user_id in self.active_chats:
+            return None
+        agent_heap = self._agent_heap
+        while agent_heap and not self._is_current(*agent_heap[0]):
+            heapq.heappop(agent_heap)
+        if not agent_heap:
+            return None
+        agent_id = heapq.heappop(agent_heap)[2]
+        await self.start_chat(user_id, agent_id)
+        return agent_id
+
+    def _load(self, agent_id: str) -> int:
+        return len(self.agent_chats.get(agent_id, ()))
+
+    def _is_current(self, load: int, last_assigned: float, agent_id: str) -> bool:
+        return (agent_id in self.agents and load == self._load(agent_id)
+                and last_assigned == self.last_assigned.get(agent_id, 0.0)
+                and load < self.capacity.get(agent_id, LIVECHAT_AGENT_CAPACITY))
+
+    def _push_agent(self, agent_id: str):
+        """Adds the agent's current load to the heap if it is online and has room."""
+        entry = (self._load(agent_id), self.last_assigned.get(agent_id, 0.0), agent_id)
+        if self._is_current(*entry):
+            heapq.heappush(self._agent_heap, entry)
+
+    def _compact(self):
+        """Rebuilds a heap once stale entries outnumber live ones, so churn can't grow it without bound."""
+        if len(self._user_heap) > 2 * len(self.wait_queue) + 64:
+            self._user_heap = [(enqueued_at, user_id) for user_id, enqueued_at in self.wait_queue.items()]
+            heapq.heapify(self._user_heap)
+        if len(self._agent_heap) > 2 * len(self.agents) + 64:
+            self._agent_heap = [entry for entry in self._agent_heap if self._is_current(*entry)]
+            heapq.heapify(self._agent_heap)
+
+    async def get_queue(self) -> Tuple[int, List[str]]:
+        """Returns the sequence number and the wait queue as of that number."""
+        return self.queue_seq, list(self.wait_queue)
+
+    async def start_chat(self, user_id: str, agent_id: str):
+        self.active_chats[user_id] = agent_id
+        self.agent_chats.setdefault(agent_id, set()).add(user_id)
+        self.last_assigned[agent_id] = time.time()
+        self._push_agent(agent_id)
+
+    async def end_chat(self, user_id: str) -> Optional[str]:
+        """Removes the chat and returns its agent; only one caller gets the agent back."""
+        agent_id = self.active_chats.pop(user_id, None)
+        if agent_id is not None:
+            users = self.agent_chats.get(agent_id)
+            if users is not None:
+                users.discard(user_id)
+                if not users:
+                    del self.agent_chats[agent_id]
+            self._push_agent(agent_id)
+            self._compact()
+        return agent_id
+
+    async def get_agent_for(self, user_id: str) -> Optional[str]:
+        return self.active_chats.get(user_id)
+
+    async def get_users_for(self, agent_id: str) -> List[str]:
+        return list(self.agent_chats.get(agent_id, ()))
+
+    async def get_stats(self) -> Dict[str, int]:
+        """Returns the shared state sizes: online agents (and those with room), wait queue length and active chats."""
+        available = sum(self._load(agent_id) < self.capacity.get(agent_id, LIVECHAT_AGENT_CAPACITY) for agent_id in self.agents)
+        return {"online_agents": len(self.agents), "available_agents": available,
+                "wait_queue": len(self.wait_queue), "active_chats": len(self.active_chats)}
+
+# Agents with room are kept in a sorted set scored load * 1e10 + last assignment time (seconds),
+# i.e. by load, then by who has gone longest without a chat.
+
+# KEYS: agents, capacity, last_assigned, available, the agent's chat set. ARGV: agent_id, default capacity
+_REFRESH_AGENT_LUA = """
+if redis.call('SISMEMBER', KEYS[1], ARGV[1]) == 0 then
+    redis.call('ZREM', KEYS[4], ARGV[1])
+    return 0
+end
+local load = redis.call('SCARD', KEYS[5])
+local capacity = tonumber(redis.call('HGET', KEYS[2], ARGV[1]) or ARGV[2])
+if load < capacity then
+    local last_assigned = tonumber(redis.call('HGET', KEYS[3], ARGV[1]) or 0)
+    redis.call('ZADD', KEYS[4], string.format('%.3f', load * 1e10 + last_assigned), ARGV[1])
+else
+    redis.call('ZREM', KEYS[4], ARGV[1])
+end
+return load
+"""
+
+# Shared by the scripts below. KEYS[1..4]: chats, capacity, last_assigned, available.
+# ARGV[1..3]: agent chat set prefix, default capacity, now.
+_START_CHAT_LUA = """
+local function start_chat(user_id, agent_id)
+    local agent_chats = ARGV[1] .. ':' .. agent_id
+    redis.call('HSET', KEYS[1], user_id, agent_id)
+    redis.call('SADD', agent_chats, user_id)
+    redis.call('HSET', KEYS[3], agent_id, ARGV[3])
+    local load = redis.call('SCARD', agent_chats)
+    local capacity = tonumber(redis.call('HGET', KEYS[2], agent_id) or ARGV[2])
+    if load < capacity then
+        redis.call('ZADD', KEYS[4], string.format('%.3f', load * 1e10 + tonumber(ARGV[3])), agent_id)
+    else
+        redis.call('ZREM', KEYS[4], agent_id)
+    end
+end
+"""
+
+# KEYS[5..6]: queue, queue_seq. Returns {user, agent, enqueued_at, seq} or nil.
+_ASSIGN_LUA = _START_CHAT_LUA + """
+local users = redis.call('ZRANGE', KEYS[5], 0, 0, 'WITHSCORES')
+local agents = redis.call('ZRANGE', KEYS[4], 0, 0)
+if #users == 0 or #agents == 0 then
+    return false
+end
+redis.call('ZREM', KEYS[5], users[1])
+local seq = redis.call('INCR', KEYS[6])
+start_chat(users[1], agents[1])
+return {users[1], agents[1], users[2], seq}
+"""
+
+# KEYS[5]: queue. ARGV[4]: user_id. Returns the agent, or nil if anyone is waiting or no agent has room.
+_CLAIM_AGENT_LUA = _START_CHAT_LUA + """
+if redis.call('ZCARD', KEYS[5]) > 0 or redis.call('HEXISTS', KEYS[1], ARGV[4]) == 1 then
+    return false
+end
+local agents = redis.call('ZRANGE', KEYS[4], 0, 0)
+if #agents == 0 then
+    return false
+end
+start_chat(ARGV[4], agents[1])
+return agents[1]
+"""
+
+class RedisBackend:
+    """
+    Live-chat state in Redis (or any server speaking its protocol), shared by every worker.
+    Claims (dequeue, assign_next, end_chat) are atomic on the server, so two workers can never both win.
+    Assignment runs as a Lua script over two sorted sets (waiting users by enqueue time, agents
+    with room by load), so it is O(log n) and needs a single instance rather than a cluster.
+    """
+
+    def __init__(self, url: str, prefix: str = "campus:livechat", client=None):
+        """client, if given, is used instead of connecting to url; it must decode responses."""
+        if client is None:
+            if aioredis is None:
+                raise RuntimeError("LIVECHAT_REDIS_URL is set but the 'redis' package is not installed (pip install -r requirements-redis.txt).")
+            client = aioredis.from_url(url, decode_responses=True)
+        self.client = client
+        self.node_id = uuid.uuid4().hex
+        self.channel = f"{prefix}:events"
+        self.agents_key = f"{prefix}:agents"
+        self.queue_key = f"{prefix}:queue"  # sorted set scored by enqueue time
+        self.queue_seq_key = f"{prefix}:queue_seq"
+        self.chats_key = f"{prefix}:chats"  # hash user_id -> agent_id
+        self.agent_chats_prefix = f"{prefix}:agent_chats"  # set per agent, reverse of chats_key
+        self.capacity_key = f"{prefix}:capacity"  # hash agent_id -> max concurrent chats, when set
+        self.last_assigned_key = f"{prefix}:last_assigned"  # hash agent_id -> time of its last chat
+        self.available_key = f"{prefix}:available"  # sorted set of agents with room, by load
+        self._refresh_agent = self.client.register_script(_REFRESH_AGENT_LUA)
+        self._assign = self.client.register_script(_ASSIGN_LUA)
+        self._claim_agent = self.client.register_script(_CLAIM_AGENT_LUA)
+        self._pubsub = None
+        self._reader: Optional[asyncio.Task] = None
+
+    async def start(self, on_message: MessageHandler):
+        self._pubsub = self.client.pubsub()
+        await self._pubsub.subscribe(self.channel)
+        self._reader = asyncio.create_task(self._read(on_message))
+        logger.info(f"Live chat backend: Redis, node {self.node_id}")
+
+    async def _read(self, on_message: MessageHandler):
+        async for message in self._pubsub.listen():
+            if message.get("type") != "message":
+                continue
+            try:
+                envelope = json.loads(message["data"])
+                if envelope.get("origin") != self.node_id:
+                    await on_message(envelope)
+            except Exception as e:
+                logger.error(f"Error handling live chat event: {e!r}")
+
+    async def stop(self):
+        if self._reader:
+            self._reader.cancel()
+            try:
+                await self._reader
+            except asyncio.CancelledError:
+                pass
+        if self._pubsub:
+            await self._pubsub.unsubscribe(self.channel)
+            await self._pubsub.aclose()
+        await self.client.aclose()
+
+    async def publish(self, envelope: dict):
+        await self.client.publish(self.channel, json.dumps({**envelope, "origin": self.node_id}))
+
+    async def add_agent(self, agent_id: str):
+        await self.client.sadd(self.agents_key, agent_id)
+        await self._update_availability(agent_id)
+
+    async def remove_agent(self, agent_id: str):
+        await self.client.srem(self.agents_key, agent_id)
+        await self._update_availability(agent_id)
+
+    async def set_capacity(self, agent_id: str, max_chats: int):
+        await self.client.hset(self.capacity_key, agent_id, max_chats)
+        await self._update_availability(agent_id)
+
+    async def _update_availability(self, agent_id: str):
+        await self._refresh_agent(
+            keys=[self.agents_key, self.capacity_key, self.last_assigned_key, self.available_key,
+                  f"{self.agent_chats_prefix}:{agent_id}"],
+            args=[agent_id, LIVECHAT_AGENT_CAPACITY],
+        )
+
+    async def enqueue(self, user_id: str) -> Optional[int]:
+        if await self.client.zadd(self.queue_key, {user_id: time.time()}, nx=True) != 1:
+            return None
+        return await self.client.incr(self.queue_seq_key)
+
+    async def dequeue(self, user_id: str) -> Optional[Tuple[int, float]]:
+        async with self.client.pipeline(transaction=True) as pipe:
+            enqueued_at, removed = await pipe.zscore(self.queue_key, user_id).zrem(self.queue_key, user_id).execute()
+        if removed != 1:
+            return None
+        return await self.client.incr(self.queue_seq_key), enqueued_at
+
+    async def assign_next(self) -> Optional[Assignment]:
+        result = await self._assign(
+            keys=[self.chats_key, self.capacity_key, self.last_assigned_key, self.available_key,
+                  self.queue_key, self.queue_seq_key],
+            args=[self.agent_chats_prefix, LIVECHAT_AGENT_CAPACITY, time.time()],
+        )
+        if not result:
+            return None
+        user_id, agent_id, enqueued_at, seq = result
+        return user_id, agent_id, float(enqueued_at), int(seq)
+
+    async def claim_agent(self, user_id: str) -> Optional[str]:
+        return await self._claim_agent(
+            keys=[self.chats_key, self.capacity_key, self.last_assigned_key, self.available_key, self.queue_key],
+            args=[self.agent_chats_prefix, LIVECHAT_AGENT_CAPACITY, time.time(), user_id],
+        ) or None
+
+    async def get_queue(self) -> Tuple[int, List[str]]:
+        async with self.client.pipeline(transaction=True) as pipe:
+            seq, queue = await pipe.get(self.queue_seq_key).zrange(self.queue_key, 0, -1).execute()
+        return int(seq or 0), queue
+
+    async def start_chat(self, user_id: str, agent_id: str):
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.hset(self.chats_key, user_id, agent_id).sadd(f"{self.agent_chats_prefix}:{agent_id}", user_id)
+            await pipe.hset(self.last_assigned_key, agent_id, time.time()).execute()
+        await self._update_availability(agent_id)
+
+    async def end_chat(self, user_id: str) -> Optional[str]:
+        async with self.client.pipeline(transaction=True) as pipe:
+            agent_id, removed = await pipe.hget(self.chats_key, user_id).hdel(self.chats_key, user_id).execute()
+        if not removed:
+            return None
+        await self.client.srem(f"{self.agent_chats_prefix}:{agent_id}", user_id)
+        await self._update_availability(agent_id)
+        return agent_id
+
+    async def get_agent_for(self, user_id: str) -> Optional[str]:
+        return await self.client.hget(self.chats_key, user_id)
+
+    async def get_users_for(self, agent_id: str) -> List[str]:
+        return list(await self.client.smembers(f"{self.agent_chats_prefix}:{agent_id}"))
+
+    async def get_stats(self) -> Dict[str, int]:
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.scard(self.agents_key).zcard(self.available_key)
+            agents, available, queued, chats = await pipe.zcard(self.queue_key).hlen(self.chats_key).execute()
+        return {"online_agents": agents, "available_agents": available, "wait_queue": queued, "active_chats": chats}
+
+def create_backend() -> Union[LocalBackend, RedisBackend]:
+    """Returns the Redis backend when LIVECHAT_REDIS_URL is set, otherwise the in-process one."""
+    if LIVECHAT_REDIS_URL:
+        return RedisBackend(LIVECHAT_REDIS_URL)
+    return LocalBackend()
@@ -0,0 +1,211 @@
+# llm_dispatcher.py
+import os
+import time
+import heapq
+import random
+import asyncio
+import logging
+import itertools
+from typing import Dict, Any, List, Tuple, Callable, Awaitable, AsyncIterable, AsyncIterator
+
+from google.api_core import exceptions as google_exceptions
+
+logger = logging.getLogger(__name__)
+
+# Gemini calls in flight per worker, and the request quota they are paced to (0 disables pacing).
+# LLM_BURST requests may go out back to back before pacing kicks in.
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_REQUESTS_PER_MINUTE = float(os.getenv("LLM_REQUESTS_PER_MINUTE", "1000"))
+LLM_BURST = int(os.getenv("LLM_BURST", "50"))
+# Retries after a quota or availability error, with full-jitter exponential backoff
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_BACKOFF_SECONDS = float(os.getenv("LLM_BACKOFF_SECONDS", "0.5"))
+LLM_BACKOFF_MAX_SECONDS = 8.0
+
+# Lower runs first: short prompts, then full-context prompts, then background work like summaries
+PRIORITY_SHORT = 0
+PRIORITY_FULL = 1
+PRIORITY_BACKGROUND = 2
+
+RETRYABLE_ERRORS = (
+    google_exceptions.TooManyRequests,  # includes ResourceExhausted (quota)
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.InternalServerError,
+)
+
+class TokenBucket:
+    """Allows `rate` requests per second on average and up to `burst` at once."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = float(self.burst)
+        self._updated = time.monotonic()
+
+    def take(self) -> float:
+        """Takes a token and returns 0, or returns how many seconds until one is available."""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def drain(self):
+        """Empties the bucket, e.g. after the server said we are over quota."""
+        self.tokens = 0.0
+        self._updated = time.monotonic()
+
+class LLMDispatcher:
+    """
+    Every Gemini call in the worker goes through here.
+
+    - Identical prompts in flight at the same time share one call (single-flight).
+    - Calls start in priority order, at most max_concurrency at a time and paced by a token
+      bucket sized to the quota, so bursts queue here instead of turning into 429s.
+    - Quota and availability errors are retried with jittered backoff; a 429 also drains the
+      bucket so the other queued calls slow down too.
+
+    Only used from the event loop.
+    """
+
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY, requests_per_minute: float = LLM_REQUESTS_PER_MINUTE,
+                 burst: int = LLM_BURST, max_retries: int = LLM_MAX_RETRIES, backoff_seconds: float = LLM_BACKOFF_SECONDS):
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self._bucket = TokenBucket(requests_per_minute / 60, burst)
+        self._waiting: List[Tuple[int, int, asyncio.Future]] = []  # heap of (priority, arrival, grant)
+        self._arrivals = itertools.count()
+        self._active = 0
+        self._timer = None
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.stats = {"calls": 0, "coalesced": 0, "retries": 0, "throttled": 0, "failures": 0}
+
+    # --- Scheduling ---
+
+    async def _acquire(self, priority: int):
+        grant = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (priority, next(self._arrivals), grant))
+        self._pump()
+        try:
+            await grant
+        except asyncio.CancelledError:
+            if grant.done() and not grant.cancelled():
+                # Granted just as the caller gave up; hand the slot on
+                self._release()
+            else:
+                grant.cancel()
+            raise
+
+    def _release(self):
+        self._active -= 1
+        self._pump()
+
+    def _pump(self):
+        """Grants slots to the highest-priority waiters while concurrency and the rate allow."""
+        while self._waiting and self._active < self.max_concurrency:
+            grant = self._waiting[0][2]
+            if grant.done():
+                # Cancelled while waiting
+                heapq.heappop(self._waiting)
+                continue
+            wait = self._bucket.take()
+            if wait > 0:
+                if self._timer is None:
+                    self.stats["throttled"] += 1
+                    self._timer = asyncio.get_running_loop().call_later(wait, self._on_timer)
+                return
+            heapq.heappop(self._waiting)
+            self._active += 1
+            grant.set_result(None)
+
+    def _on_timer(self):
+        self._timer = None
+        self._pump()
+
+    async def _backoff(self, attempt: int, error: Exception, deadline: float):
+        if isinstance(error, google_exceptions.TooManyRequests):
+            self._bucket.drain()
+        delay = random.uniform(0, min(LLM_BACKOFF_MAX_SECONDS, self.backoff_seconds * 2 ** attempt))
+        if time.monotonic() + delay >= deadline:
+            raise error
+        self.stats["retries"] += 1
+        logger.warning(f"Gemini call failed ({error!r}); retrying in {delay:.2f}s")
+        await asyncio.sleep(delay)
+
+    # --- Calls ---
+
+    async def generate(self, prompt: str, call: Callable[[str], Awaitable[Any]], priority: int = PRIORITY_FULL,
+                       timeout: float = 20.0) -> Any:
+        """
+        Returns call(prompt), sharing the result with any identical prompt already in flight.
+        The shared call keeps running if this caller is cancelled or times out.
+        """
+        task = self._inflight.get(prompt)
+        if task is None:
+            task = asyncio.create_task(self._run(prompt, call, priority, timeout))
+            self._inflight[prompt] = task
+            task.add_done_callback(lambda done: self._finished(prompt, done))
+        else:
+            self.stats["coalesced"] += 1
+        return await asyncio.shield(task)
+
+    def _finished(self, prompt: str, task: asyncio.Task):
+        if self._inflight.get(prompt) is task:
+            del self._inflight[prompt]
+        if not task.cancelled() and task.exception() is not None:
+            self.stats["failures"] += 1
+
+    async def _run(self, prompt: str, call: Callable[[str], Awaitable[Any]], priority: int, timeout: float) -> Any:
+        deadline = time.monotonic() + timeout
+        for attempt in range(self.max_retries + 1):
+            await asyncio.wait_for(self._acquire(priority), timeout=deadline - time.monotonic())
+            try:
+                self.stats["calls"] += 1
+                return await asyncio.wait_for(call(prompt), timeout=deadline - time.monotonic())
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    raise
+                error = e
+            finally:
+                self._release()
+            await self._backoff(attempt, error, deadline)
+
+    async def stream(self, open_stream: Callable[[], Awaitable[AsyncIterable]], priority: int = PRIORITY_FULL,
+                     timeout: float = 20.0) -> AsyncIterator[Any]:
+        """
+        Yields the chunks of open_stream()'s response, holding a slot until the stream ends.
+        Streams are not shared, and are only retried if they fail before the first chunk.
+        """
+        deadline = time.monotonic() + timeout
+        for attempt in range(self.max_retries + 1):
+            await asyncio.wait_for(self._acquire(priority), timeout=deadline - time.monotonic())
+            started = False
+            try:
+                self.stats["calls"] += 1
+                response = await asyncio.wait_for(open_stream(), timeout=deadline - time.monotonic())
+                chunks = response.__aiter__()
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(chunks.__anext__(), timeout=deadline - time.monotonic())
+                    except StopAsyncIteration:
+                        return
+                    started = True
+                    yield chunk
+            except Exception as e:
+                if started or attempt == self.max_retries or not isinstance(e, RETRYABLE_ERRORS):
+                    self.stats["failures"] += 1
+                    raise
+                error = e
+            finally:
+                self._release()
+            await self._backoff(attempt, error, deadline)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Returns call/retry counters plus the current queue depth and calls in flight."""
+        return {**self.stats, "queued": sum(not grant.done() for _, _, grant in self._waiting),
+                "active": self._active, "inflight_prompts": len(self._inflight)}
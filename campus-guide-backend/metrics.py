@@ -0,0 +1,155 @@
+# metrics.py
+import os
+import time
+import threading
+import contextvars
+from typing import Dict, Any, Optional, List, Tuple
+
+# Set METRICS_ENABLED=0 to turn every timer into a no-op. Server-Timing headers cost an extra
+# middleware per request, so they are off unless METRICS_TRACE_HEADERS=1.
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+TRACE_HEADERS = METRICS_ENABLED and os.getenv("METRICS_TRACE_HEADERS", "0") == "1"
+PREFIX = "campus"
+
+# Upper bounds in seconds, from sub-millisecond SQLite reads to slow Gemini calls
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class Counter:
+    """A counter with one label; safe to update from worker threads."""
+
+    def __init__(self, name: str, help_text: str, label: str):
+        self.name = f"{PREFIX}_{name}"
+        self.help_text = help_text
+        self.label = label
+        self._values: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, label_value: str, amount: float = 1):
+        with self._lock:
+            self._values[label_value] = self._values.get(label_value, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        lines += [f'{self.name}{{{self.label}="{_escape(key)}"}} {value}' for key, value in values]
+        return lines
+
+class Histogram:
+    """A latency histogram with one label; safe to update from worker threads."""
+
+    def __init__(self, name: str, help_text: str, label: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = f"{PREFIX}_{name}"
+        self.help_text = help_text
+        self.label = label
+        self.buckets = buckets
+        self._series: Dict[str, List[float]] = {}  # label value -> bucket counts + [sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, label_value: str, seconds: float):
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += seconds
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = sorted((key, list(series)) for key, series in self._series.items())
+        for key, series in snapshot:
+            label = f'{self.label}="{_escape(key)}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {series[-1]}')
+            lines.append(f"{self.name}_sum{{{label}}} {round(series[-2], 6)}")
+            lines.append(f"{self.name}_count{{{label}}} {series[-1]}")
+        return lines
+
+CHAT_STAGE_SECONDS = Histogram("chat_stage_seconds", "Time spent in each stage of answering a chat message.", "stage")
+DB_QUERY_SECONDS = Histogram("db_query_seconds", "SQLite query time by statement and table.", "query")
+CHAT_ANSWERS = Counter("chat_answers_total", "Chat answers by where they came from.", "source")
+LLM_TOKENS = Counter("llm_tokens_total", "Gemini tokens used, from usage metadata when available.", "kind")
+LLM_REQUESTS = Counter("llm_requests_total", "Gemini calls by outcome.", "outcome")
+
+_METRICS = (CHAT_STAGE_SECONDS, DB_QUERY_SECONDS, CHAT_ANSWERS, LLM_TOKENS, LLM_REQUESTS)
+
+# Stage timings of the current request, when Server-Timing headers are on
+_trace: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar("metrics_trace", default=None)
+
+class _Stage:
+    __slots__ = ("name", "started")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.started
+        CHAT_STAGE_SECONDS.observe(self.name, elapsed)
+        trace = _trace.get()
+        if trace is not None:
+            trace[self.name] = trace.get(self.name, 0.0) + elapsed
+        return False
+
+class _NoopStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NOOP_STAGE = _NoopStage()
+
+def stage(name: str):
+    """Context manager timing one stage of a chat request; a shared no-op when metrics are off."""
+    return _Stage(name) if METRICS_ENABLED else _NOOP_STAGE
+
+def count(counter: Counter, label_value: str, amount: float = 1):
+    if METRICS_ENABLED:
+        counter.inc(label_value, amount)
+
+def start_trace() -> Dict[str, float]:
+    """Starts collecting stage timings for the current request; returns the dict they go into."""
+    trace: Dict[str, float] = {}
+    _trace.set(trace)
+    return trace
+
+def server_timing(trace: Dict[str, float]) -> str:
+    """Formats stage timings as a Server-Timing header value."""
+    return ", ".join(f"{name};dur={seconds * 1000:.2f}" for name, seconds in trace.items())
+
+def _render_stats(component: str, stats: Dict[str, Any]) -> List[str]:
+    lines = []
+    for key, value in sorted(stats.items()):
+        # bool is an int subclass; None means "not known yet"
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        name = f"{PREFIX}_{component}_{key}"
+        lines += [f"# TYPE {name} gauge", f"{name} {value}"]
+    return lines
+
+def render(component_stats: Dict[str, Dict[str, Any]]) -> str:
+    """
+    Prometheus text exposition of the timers and counters above, plus the numeric
+    values of each component's get_stats() dict as campus_<component>_<key> gauges.
+    """
+    lines: List[str] = []
+    for metric in _METRICS:
+        lines += metric.render()
+    for component, stats in component_stats.items():
+        lines += _render_stats(component, stats)
+    return "\n".join(lines) + "\n"
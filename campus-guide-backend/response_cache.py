@@ -0,0 +1,131 @@
+# response_cache.py
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Set, Tuple
+
+# Size, lifetime and near-duplicate threshold (Jaccard over query words) of the cache.
+# Near-duplicate matching is off by default (0); when on, a cached query only matches if it has
+# exactly the same content words, so it can differ only in filler like "the", "a" or "please".
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1024"))
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "3600"))
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0"))
+
+_WORD_RE = re.compile(r"\w+")
+
+# Words that don't change what is being asked. Negations ("not", "no", "never") are deliberately absent.
+STOPWORDS = frozenset("""
+a an the is are was were be been am do does did can could would should will shall may might
+i me my we our you your it its this that these those there here of to in on at for from by with
+about please tell show give know any some what's whats hi hello hey thanks thank kindly
+""".split())
+
+def content_words(normalized: str) -> frozenset:
+    return frozenset(word for word in normalized.split() if word not in STOPWORDS)
+
+CacheKey = Tuple[str, str]  # (normalized query, target_lang)
+
+def normalize_query(query: str) -> str:
+    """Lowercases and strips punctuation so trivially different phrasings share a key."""
+    return " ".join(_WORD_RE.findall(query.lower()))
+
+class ResponseCache:
+    """
+    LRU + TTL cache of chat responses for one campus data version.
+    Entries are dropped wholesale when the version changes. Only used from the event loop.
+    """
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_SIZE, ttl_seconds: float = RESPONSE_CACHE_TTL_SECONDS,
+                 similarity_threshold: float = RESPONSE_CACHE_SIMILARITY):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self._entries: "OrderedDict[CacheKey, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._word_index: Dict[Tuple[str, str], Set[CacheKey]] = {}  # (lang, word) -> keys containing it
+        self._version: Optional[int] = None
+        self.stats = {"hits": 0, "near_hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def _check_version(self, version: int):
+        if version != self._version:
+            if self._entries:
+                self.stats["invalidations"] += 1
+            self._entries.clear()
+            self._word_index.clear()
+            self._version = version
+
+    def _remove(self, key: CacheKey):
+        self._entries.pop(key, None)
+        normalized, lang = key
+        for word in set(normalized.split()):
+            keys = self._word_index.get((lang, word))
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._word_index[(lang, word)]
+
+    def _live_entry(self, key: CacheKey, now: float) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        stored_at, response = entry
+        if now - stored_at > self.ttl_seconds:
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return response
+
+    def _find_near_duplicate(self, normalized: str, lang: str, now: float) -> Optional[Dict[str, Any]]:
+        words = set(normalized.split())
+        content = content_words(normalized)
+        if not content:
+            return None
+        # Candidates share at least one content word; only those with exactly the same ones qualify
+        overlap: Dict[CacheKey, int] = {}
+        for word in words:
+            for key in self._word_index.get((lang, word), ()):
+                overlap[key] = overlap.get(key, 0) + 1
+        best_key, best_score = None, 0.0
+        for key, shared in overlap.items():
+            if content_words(key[0]) != content:
+                continue
+            score = shared / len(words | set(key[0].split()))
+            if score > best_score:
+                best_key, best_score = key, score
+        if best_key is None or best_score < self.similarity_threshold:
+            return None
+        return self._live_entry(best_key, now)
+
+    def get(self, query: str, target_lang: str, version: int) -> Optional[Dict[str, Any]]:
+        """Returns a copy of the cached response for this query, or None."""
+        self._check_version(version)
+        now = time.monotonic()
+        normalized = normalize_query(query)
+        response = self._live_entry((normalized, target_lang), now)
+        if response is not None:
+            self.stats["hits"] += 1
+            return dict(response)
+        if self.similarity_threshold > 0:
+            response = self._find_near_duplicate(normalized, target_lang, now)
+            if response is not None:
+                self.stats["near_hits"] += 1
+                return dict(response)
+        self.stats["misses"] += 1
+        return None
+
+    def put(self, query: str, target_lang: str, version: int, response: Dict[str, Any]):
+        self._check_version(version)
+        key = (normalize_query(query), target_lang)
+        self._remove(key)
+        self._entries[key] = (time.monotonic(), dict(response))
+        for word in set(key[0].split()):
+            self._word_index.setdefault((target_lang, word), set()).add(key)
+        while len(self._entries) > self.max_entries:
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+            self.stats["evictions"] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.stats["hits"] + self.stats["near_hits"] + self.stats["misses"]
+        hit_rate = (self.stats["hits"] + self.stats["near_hits"]) / lookups if lookups else 0.0
+        return {**self.stats, "size": len(self._entries), "hit_rate": round(hit_rate, 4)}
@@ -0,0 +1,150 @@
+# retrieval.py
+import os
+import re
+import math
+import threading
+from collections import Counter
+from typing import List, Dict, Any, Tuple
+
+# Number of records and approximate token budget for the campus context in the general prompt
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "8"))
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "1500"))
+
+# BM25 parameters
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_TOKEN_RE = re.compile(r"\w+")
+_STOPWORDS = {
+    "a", "an", "the", "is", "are", "was", "of", "to", "in", "on", "at", "for", "and", "or",
+    "what", "where", "who", "when", "how", "which", "i", "me", "my", "you", "can", "do", "does",
+    "please", "tell", "about", "there", "it", "this", "that", "with", "be", "find",
+}
+
+# Extra words indexed with each record type so generic questions ("any events?") still match
+_KIND_KEYWORDS = {
+    "locations": "location place building room",
+    "faculty": "faculty professor teacher staff contact",
+    "events": "event events fest festival happening",
+    "courses": "course subject class credits teaches",
+}
+
+_index = None
+_index_lock = threading.Lock()
+_stats = {"prompts": 0, "context_tokens": 0, "tokens_saved": 0}
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about 4 characters per token for English text)."""
+    return (len(text) + 3) // 4
+
+def _tokenize(text: str) -> List[str]:
+    tokens = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        if token in _STOPWORDS:
+            continue
+        # Crude plural stemming so "labs" matches "lab"
+        if len(token) > 3 and token.endswith("s"):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+def _serialize(kind: str, record: Dict[str, Any]) -> str:
+    """Compact one-line form of a record for the prompt."""
+    if kind == "locations":
+        return f"{record['name']}: {record['details']}"
+    if kind == "faculty":
+        return f"{record['name']} | {record['department']} | {record['location']} | {record['contact']}"
+    if kind == "events":
+        return f"{record['name']} | {record['date']} | {record['venue']} | {record['description']}"
+    return (f"{record['code']} {record['name']} | {record['department']} | {record['instructor']} | "
+            f"{record['credits']} credits | {record['description']}")
+
+class _BM25Index:
+    """Inverted index over the campus records of one snapshot."""
+
+    def __init__(self, campus_data: Dict[str, Any]):
+        self.source = campus_data
+        self.docs: List[Tuple[str, str]] = []  # (kind, serialized line)
+        self.lengths: List[int] = []
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}
+        for kind in _KIND_KEYWORDS:
+            for record in campus_data.get(kind) or []:
+                line = _serialize(kind, record)
+                terms = Counter(_tokenize(f"{line} {_KIND_KEYWORDS[kind]}"))
+                doc_id = len(self.docs)
+                self.docs.append((kind, line))
+                self.lengths.append(sum(terms.values()))
+                for term, freq in terms.items():
+                    self.postings.setdefault(term, []).append((doc_id, freq))
+        self.avg_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0.0
+        self.full_tokens = estimate_tokens(repr(campus_data))
+
+    def top_k(self, query: str, k: int) -> List[int]:
+        scores: Dict[int, float] = {}
+        n_docs = len(self.docs)
+        for term in set(_tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, freq in postings:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[doc_id] / self.avg_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * freq * (BM25_K1 + 1) / (freq + norm)
+        return sorted(scores, key=scores.get, reverse=True)[:k]
+
+def _get_index(campus_data: Dict[str, Any]) -> _BM25Index:
+    """Returns the index for this snapshot, rebuilding it when database hands out a new one."""
+    global _index
+    index = _index
+    if index is None or index.source is not campus_data:
+        with _index_lock:
+            if _index is None or _index.source is not campus_data:
+                _index = _BM25Index(campus_data)
+            index = _index
+    return index
+
+def warm_up(campus_data: Dict[str, Any]):
+    """Builds the index for this snapshot ahead of the first request."""
+    _get_index(campus_data)
+
+def _format_sections(grouped: Dict[str, List[str]]) -> str:
+    sections = [f"{kind.capitalize()}:\n" + "\n".join(f"- {line}" for line in lines) for kind, lines in grouped.items()]
+    return "\n".join(sections) if sections else "(no matching records)"
+
+def full_context(campus_data: Dict[str, Any]) -> str:
+    """Every campus record in the build_context format, e.g. for a cached prompt prefix."""
+    grouped: Dict[str, List[str]] = {}
+    for kind, line in _get_index(campus_data).docs:
+        grouped.setdefault(kind, []).append(line)
+    return _format_sections(grouped)
+
+def build_context(query: str, campus_data: Dict[str, Any], top_k: int = None, token_budget: int = None) -> str:
+    """
+    Returns the campus records most relevant to `query`, grouped by type, in a compact
+    line-per-record format that fits within `token_budget`.
+    """
+    top_k = RETRIEVAL_TOP_K if top_k is None else top_k
+    token_budget = PROMPT_TOKEN_BUDGET if token_budget is None else token_budget
+    index = _get_index(campus_data)
+
+    grouped: Dict[str, List[str]] = {}
+    used_tokens = 0
+    for doc_id in index.top_k(query, top_k):
+        kind, line = index.docs[doc_id]
+        cost = estimate_tokens(line) + 1
+        if used_tokens + cost > token_budget:
+            break
+        grouped.setdefault(kind, []).append(line)
+        used_tokens += cost
+
+    context = _format_sections(grouped)
+
+    context_tokens = estimate_tokens(context)
+    _stats["prompts"] += 1
+    _stats["context_tokens"] += context_tokens
+    _stats["tokens_saved"] += max(index.full_tokens - context_tokens, 0)
+    return context
+
+def get_retrieval_stats() -> Dict[str, int]:
+    """Returns counters for prompts built, context tokens sent and tokens saved versus the full dump."""
+    return dict(_stats)
@@ -0,0 +1,153 @@
+# sessions.py
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import List, Dict, Optional, Callable, Awaitable, Set
+
+from retrieval import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Most recent messages kept verbatim, token budget for the history in the prompt,
+# and how many older messages accumulate before they are folded into the summary.
+HISTORY_WINDOW_MESSAGES = int(os.getenv("HISTORY_WINDOW_MESSAGES", "6"))
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "600"))
+HISTORY_SUMMARIZE_EVERY = int(os.getenv("HISTORY_SUMMARIZE_EVERY", "6"))
+SUMMARY_MAX_CHARS = 1200
+
+# Longest accepted user message; longer history messages are cut to it. Only the most recent
+# MAX_HISTORY_MESSAGES of a client's history are looked at.
+MAX_MESSAGE_CHARS = int(os.getenv("MAX_MESSAGE_CHARS", "2000"))
+MAX_HISTORY_MESSAGES = int(os.getenv("MAX_HISTORY_MESSAGES", "50"))
+
+# Server-side sessions are per worker and evicted after inactivity or when there are too many
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", "10000"))
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", "3600"))
+
+Message = Dict[str, str]
+Summarizer = Callable[[str], Awaitable[str]]
+
+def clip_client_history(history: List[Message]) -> List[Message]:
+    """
+    The part of a client's history the server uses: the last MAX_HISTORY_MESSAGES messages, each
+    cut to MAX_MESSAGE_CHARS. Clients without a session resend the whole conversation every turn,
+    including long replies, so this trims rather than rejects.
+    """
+    return [{**msg, "content": msg["content"][:MAX_MESSAGE_CHARS]} for msg in history[-MAX_HISTORY_MESSAGES:]]
+
+def trim_history(history: List[Message], summary: str = "") -> List[Message]:
+    """
+    Keeps the most recent messages that fit in HISTORY_WINDOW_MESSAGES and HISTORY_TOKEN_BUDGET.
+    A non-empty summary of older turns is prepended as a "summary" message.
+    """
+    budget = HISTORY_TOKEN_BUDGET
+    kept: List[Message] = []
+    if summary:
+        summary = summary[:SUMMARY_MAX_CHARS]
+        budget -= estimate_tokens(summary)
+    for msg in reversed(history[-HISTORY_WINDOW_MESSAGES:]):
+        cost = estimate_tokens(msg["content"])
+        if cost > budget:
+            break
+        kept.append(msg)
+        budget -= cost
+    kept.reverse()
+    if summary:
+        kept.insert(0, {"role": "summary", "content": summary})
+    return kept
+
+class Session:
+    def __init__(self):
+        self.summary = ""
+        self.messages: List[Message] = []  # recent turns, verbatim
+        self.pending: List[Message] = []  # turns that left the window but aren't summarized yet
+        self.last_seen = time.monotonic()
+        self.summarizing = False
+
+class SessionStore:
+    """
+    Conversation state keyed by session id, so clients don't need to resend the whole
+    history: a rolling window of recent messages plus a summary of everything older.
+    Only used from the event loop.
+    """
+
+    def __init__(self, max_sessions: int = MAX_SESSIONS, ttl_seconds: float = SESSION_TTL_SECONDS):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._tasks: Set[asyncio.Task] = set()
+        self.stats = {"summaries": 0, "summary_failures": 0}
+
+    def _get(self, session_id: str) -> Optional[Session]:
+        session = self._sessions.get(session_id)
+        if session is not None and time.monotonic() - session.last_seen > self.ttl_seconds:
+            del self._sessions[session_id]
+            session = None
+        return session
+
+    def history_for(self, session_id: str, client_history: List[Message]) -> List[Message]:
+        """
+        Returns the compacted history to use for this turn. A session the server doesn't know
+        (new, expired, or started on another worker) is seeded from the client's history.
+        """
+        session = self._get(session_id)
+        if session is None:
+            session = Session()
+            self._sessions[session_id] = session
+            for msg in client_history:
+                self._append(session, msg)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        self._sessions.move_to_end(session_id)
+        session.last_seen = time.monotonic()
+        return trim_history(session.messages, session.summary)
+
+    def record_turn(self, session_id: str, user_query: str, response_text: str, summarize: Summarizer):
+        """Stores a completed turn and, every HISTORY_SUMMARIZE_EVERY overflowed messages, refreshes the summary in the background."""
+        session = self._get(session_id)
+        if session is None:
+            return
+        self._append(session, {"role": "user", "content": user_query})
+        self._append(session, {"role": "assistant", "content": response_text})
+        if len(session.pending) >= HISTORY_SUMMARIZE_EVERY and not session.summarizing:
+            session.summarizing = True
+            task = asyncio.create_task(self._summarize(session, summarize))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def _append(self, session: Session, msg: Message):
+        session.messages.append({"role": msg["role"], "content": msg["content"][:MAX_MESSAGE_CHARS]})
+        overflow = len(session.messages) - HISTORY_WINDOW_MESSAGES
+        if overflow > 0:
+            session.pending.extend(session.messages[:overflow])
+            del session.messages[:overflow]
+
+    async def _summarize(self, session: Session, summarize: Summarizer):
+        pending = session.pending[:]
+        transcript = "\n".join(f"{msg['role'].capitalize()}: {msg['content']}" for msg in pending)
+        prompt = f"""
+        Summarize this campus-assistant conversation in at most 5 short sentences,
+        keeping names, places, courses and open questions the user cares about.
+
+        Earlier summary:
+        {session.summary or "(none)"}
+
+        New messages:
+        {transcript}
+        """
+        try:
+            summary = (await summarize(prompt)).strip()
+            self.stats["summaries"] += 1
+        except Exception as e:
+            logger.warning(f"History summarization failed, keeping recent user questions instead: {e!r}")
+            self.stats["summary_failures"] += 1
+            questions = "; ".join(msg["content"] for msg in pending if msg["role"] == "user")
+            summary = f"{session.summary} Earlier questions: {questions}".strip()
+        session.summary = summary[-SUMMARY_MAX_CHARS:]
+        del session.pending[:len(pending)]
+        session.summarizing = False
+
+    def get_stats(self) -> Dict[str, int]:
+        return {**self.stats, "sessions": len(self._sessions)}
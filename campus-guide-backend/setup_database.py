@@ -1,11 +1,103 @@
 # setup_database.py
 import sqlite3
+from typing import Iterable
 
-def setup():
+# Tables whose contents are served from the in-memory snapshot in database.py
+VERSIONED_TABLES = ("college_info", "locations", "faculty", "events", "courses")
+
+def create_version_triggers(cursor: sqlite3.Cursor):
+    """
+    Creates triggers that bump campus_data_version on any write to the campus tables.
+    """
+    for table in VERSIONED_TABLES:
+        for operation in ("INSERT", "UPDATE", "DELETE"):
+            cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_{operation.lower()}_bump_version
+            AFTER {operation} ON {table}
+            BEGIN
+                UPDATE campus_data_version SET version = version + 1 WHERE id = 1;
+            END;
+            """)
+
+def drop_version_triggers(cursor: sqlite3.Cursor):
+    """
+    Drops the version triggers, e.g. for a bulk load that bumps the version once at the end.
+    """
+    for table in VERSIONED_TABLES:
+        for operation in ("insert", "update", "delete"):
+            cursor.execute(f"DROP TRIGGER IF EXISTS {table}_{operation}_bump_version")
+
+def create_event_key_index(cursor: sqlite3.Cursor):
+    """
+    Makes (name, date) the natural key of events, which import_data upserts them on. Databases
+    set up more than once hold duplicate events; all but the first copy of each are deleted
+    first, or creating the index would fail.
+    """
+    cursor.execute("""
+    DELETE FROM events WHERE id NOT IN (SELECT MIN(id) FROM events GROUP BY name, date)
+    """)
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_events_name_date ON events (name, date)")
+
+# Columns indexed for fuzzy search in database.search, per table.
+# Each index is an external-content FTS5 table named <table>_fts using the trigram tokenizer.
+SEARCH_INDEXES = {
+    "locations": ("name",),
+    "faculty": ("name", "department"),
+    "courses": ("code", "name"),
+}
+
+def create_search_index(cursor: sqlite3.Cursor):
+    """
+    Creates the FTS5 search tables and the triggers that keep them in sync with their source tables.
+    """
+    for table, columns in SEARCH_INDEXES.items():
+        column_list = ", ".join(columns)
+        new_values = ", ".join(f"new.{col}" for col in columns)
+        old_values = ", ".join(f"old.{col}" for col in columns)
+        cursor.execute(f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS {table}_fts USING fts5(
+            {column_list}, content='{table}', content_rowid='id', tokenize='trigram'
+        );
+        """)
+        cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {table}_fts_insert AFTER INSERT ON {table} BEGIN
+            INSERT INTO {table}_fts (rowid, {column_list}) VALUES (new.id, {new_values});
+        END;
+        """)
+        cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {table}_fts_delete AFTER DELETE ON {table} BEGIN
+            INSERT INTO {table}_fts ({table}_fts, rowid, {column_list}) VALUES ('delete', old.id, {old_values});
+        END;
+        """)
+        cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {table}_fts_update AFTER UPDATE ON {table} BEGIN
+            INSERT INTO {table}_fts ({table}_fts, rowid, {column_list}) VALUES ('delete', old.id, {old_values});
+            INSERT INTO {table}_fts (rowid, {column_list}) VALUES (new.id, {new_values});
+        END;
+        """)
+
+def drop_search_triggers(cursor: sqlite3.Cursor):
+    """
+    Drops the triggers that keep the search indexes in sync; call rebuild_search_index and
+    create_search_index afterwards.
+    """
+    for table in SEARCH_INDEXES:
+        for operation in ("insert", "delete", "update"):
+            cursor.execute(f"DROP TRIGGER IF EXISTS {table}_fts_{operation}")
+
+def rebuild_search_index(cursor: sqlite3.Cursor, tables: Iterable[str] = SEARCH_INDEXES):
+    """
+    Rebuilds the search indexes of the given tables (all by default) from their source tables.
+    """
+    for table in tables:
+        if table in SEARCH_INDEXES:
+            cursor.execute(f"INSERT INTO {table}_fts ({table}_fts) VALUES ('rebuild')")
+
+def setup(db_name: str = "campus.db"):
     """
     Creates the database tables and populates them with initial data.
     """
-    conn = sqlite3.connect("campus.db")
+    conn = sqlite3.connect(db_name)
     cursor = conn.cursor()
 
     print("Creating tables...")
@@ -74,6 +166,20 @@ def setup():
     );
     """)
 
+    # Campus Data Version Table
+    # Bumped by triggers on every write so readers can cheaply detect changes.
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS campus_data_version (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version INTEGER NOT NULL
+    );
+    """)
+    cursor.execute("INSERT OR IGNORE INTO campus_data_version (id, version) VALUES (1, 0)")
+    create_version_triggers(cursor)
+
+    # Search Indexes
+    create_search_index(cursor)
+
     print("Populating initial data...")
 
     # College Info
@@ -115,6 +221,9 @@ def setup():
     ]
     cursor.executemany("INSERT OR IGNORE INTO courses (code, name, department, instructor, description, credits) VALUES (?, ?, ?, ?, ?, ?)", courses_data)
 
+    # Index any rows that were inserted before the search triggers existed
+    rebuild_search_index(cursor)
+
     conn.commit()
     conn.close()
     print("✅ Database setup complete!")
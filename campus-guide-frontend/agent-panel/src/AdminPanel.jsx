@@ -2,6 +2,8 @@ import React, { useState, useEffect, useRef } from 'react';
 import { Users, MessageSquare, Send, XCircle, Moon, Sun, Sparkles, Wifi, WifiOff } from 'lucide-react';
 
 const WEBSOCKET_URL = `ws://127.0.0.1:8000/ws/livechat/agent`;
+// The panel shows one conversation at a time, so ask to be auto-assigned one chat at a time
+const MAX_CHATS = 1;
 
 function AdminPanel() {
   const [ws, setWs] = useState(null);
@@ -14,6 +16,7 @@ function AdminPanel() {
   const [reconnectAttempts, setReconnectAttempts] = useState(0);
   const messagesEndRef = useRef(null);
   const reconnectTimeoutRef = useRef(null);
+  const queueSeqRef = useRef(0);
 
   const connectWebSocket = () => {
     if (ws && ws.readyState === WebSocket.OPEN) return;
@@ -22,7 +25,7 @@ function AdminPanel() {
         clearTimeout(reconnectTimeoutRef.current);
     }
     
-    const socket = new WebSocket(`${WEBSOCKET_URL}/${agentId}`);
+    const socket = new WebSocket(`${WEBSOCKET_URL}/${agentId}?max_chats=${MAX_CHATS}`);
 
     socket.onopen = () => {
         console.log(`✅ Agent WebSocket connected with ID: ${agentId}`);
@@ -38,8 +41,22 @@ function AdminPanel() {
 
             switch (data.type) {
                 case 'queue_update':
+                    queueSeqRef.current = data.seq ?? 0;
                     setWaitingUsers(data.queue);
                     break;
+                case 'queue_add':
+                case 'queue_remove':
+                    // Deltas older than the last full snapshot are already reflected in it
+                    if (data.seq <= queueSeqRef.current) break;
+                    if (data.seq !== queueSeqRef.current + 1) {
+                        // Missed an update; ask for a fresh snapshot (applying this delta is still safe)
+                        socket.send(JSON.stringify({ type: 'queue_sync' }));
+                    }
+                    queueSeqRef.current = data.seq;
+                    setWaitingUsers(prev => data.type === 'queue_add'
+                        ? (prev.includes(data.user_id) ? prev : [...prev, data.user_id])
+                        : prev.filter(id => id !== data.user_id));
+                    break;
                 case 'chat_accepted':
                     setActiveChat({ 
                         userId: data.user_id, 
@@ -109,6 +109,18 @@ function CampusChat() {
             });
             break;
             
+          case 'queue_position': {
+            const eta = data.eta_seconds == null ? '' : data.eta_seconds < 60
+              ? ' (less than a minute)'
+              : ` (about ${Math.round(data.eta_seconds / 60)} min)`;
+            const update = { role: 'system', queue: true, content: `⏳ You are number ${data.position} in the queue${eta}.` };
+            // Replace the previous position update rather than stacking them
+            setLiveMessages(prev => prev.length && prev[prev.length - 1].queue
+              ? [...prev.slice(0, -1), update]
+              : [...prev, update]);
+            break;
+          }
+
           case 'message':
             setLiveMessages(prev => [...prev, { 
               role: 'model', 